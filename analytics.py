@@ -0,0 +1,229 @@
+"""
+Columnar trade analytics — bids, fills and closed trades as append-only NumPy record files.
+
+The engine appends fixed-width records under DATA_DIR/columns/ (one .bin per table); queries
+memory-map them and aggregate with vectorized group-bys, so a 90-day report over hundreds of
+thousands of rows stays in the millisecond range.
+
+CLI:  python analytics.py [--days 90] [--by asset,hour] [--bid-price 0.25] [--json]
+"""
+import os, sys, json, time, argparse
+import numpy as np
+
+DATA_DIR = os.getenv("DATA_DIR", "/app/data")
+COLUMNS_DIR = os.path.join(DATA_DIR, "columns")
+
+ASSETS = ("?", "eth", "btc", "sol", "xrp")
+SIDES = ("Up", "Down", "?")
+EXITS = ("?", "won", "lost", "resolved", "reconciled", "manual_sell", "cancelled", "expired")
+UNFILLED_EXITS = (EXITS.index("cancelled"), EXITS.index("expired"))
+
+# end_ts is the market window end (0 when unknown); "hour" groups use the UTC hour the window opened
+TABLES = {
+    "bids": np.dtype([("ts", "<f8"), ("end_ts", "<i8"), ("asset", "u1"), ("side", "u1"),
+                      ("price", "<f4"), ("size", "<f4")]),
+    "fills": np.dtype([("ts", "<f8"), ("end_ts", "<i8"), ("asset", "u1"), ("side", "u1"),
+                       ("price", "<f4"), ("size", "<f4")]),
+    "closed": np.dtype([("ts", "<f8"), ("end_ts", "<i8"), ("asset", "u1"), ("side", "u1"), ("exit", "u1"),
+                        ("price", "<f4"), ("exit_price", "<f4"), ("size", "<f4"), ("cost", "<f4"),
+                        ("pnl", "<f4"), ("fee", "<f4")]),
+}
+
+def _code(table, value):
+    try:
+        return table.index(value)
+    except ValueError:
+        return table.index("?")
+
+# ── Writing ──
+
+class ColumnWriter:
+    """Buffers records in memory and appends them to the table files on flush()."""
+
+    def __init__(self, directory=COLUMNS_DIR):
+        self.directory = directory
+        self.pending = {name: [] for name in TABLES}
+
+    def path(self, table):
+        return os.path.join(self.directory, table + ".bin")
+
+    def exists(self):
+        return os.path.exists(self.path("closed"))
+
+    def add(self, table, ts, end_ts, asset, side, price, size, exit_type=None,
+            exit_price=0.0, cost=0.0, pnl=0.0, fee=0.0):
+        row = (ts or 0.0, end_ts or 0, _code(ASSETS, asset), _code(SIDES, side))
+        if table == "closed":
+            row += (_code(EXITS, exit_type), price or 0.0, exit_price or 0.0, size or 0.0,
+                    cost or 0.0, pnl or 0.0, fee or 0.0)
+        else:
+            row += (price or 0.0, size or 0.0)
+        self.pending[table].append(row)
+
+    def flush(self):
+        os.makedirs(self.directory, exist_ok=True)
+        for table, rows in self.pending.items():
+            if not rows:
+                continue
+            with open(self.path(table), "ab") as f:
+                f.write(np.array(rows, dtype=TABLES[table]).tobytes())
+            rows.clear()
+
+# ── Reading ──
+
+def load(table, since=None, directory=COLUMNS_DIR):
+    """Memory-map a table (ignoring a half-written trailing record), optionally from ts >= since."""
+    dtype = TABLES[table]
+    path = os.path.join(directory, table + ".bin")
+    try:
+        n = os.path.getsize(path) // dtype.itemsize
+    except OSError:
+        n = 0
+    if n == 0:
+        return np.zeros(0, dtype)
+    rec = np.memmap(path, dtype=dtype, mode="r", shape=(n,))
+    if since is not None:
+        ts = rec["ts"]
+        if n < 2 or np.all(ts[1:] >= ts[:-1]):
+            rec = rec[np.searchsorted(ts, since):]
+        else:
+            rec = rec[ts >= since]
+    return rec
+
+_KEYS = {
+    "asset": (len(ASSETS), lambda r: r["asset"].astype(np.int64),
+              lambda k: ASSETS[k] if k < len(ASSETS) else "?"),
+    "side": (len(SIDES), lambda r: r["side"].astype(np.int64),
+             lambda k: SIDES[k] if k < len(SIDES) else "?"),
+    "hour": (25, lambda r: np.where(r["end_ts"] > 0, ((r["end_ts"] - 900) // 3600) % 24, 24),
+             lambda k: "%02d" % k if k < 24 else "?"),
+}
+
+def _group_keys(rec, by):
+    key = np.zeros(len(rec), np.int64)
+    for name in by:
+        base, fn, _ = _KEYS[name]
+        key = key * base + fn(rec)
+    return key
+
+def _decode(key, by):
+    labels = {}
+    for name in reversed(by):
+        base, _, label = _KEYS[name]
+        key, k = divmod(int(key), base)
+        labels[name] = label(k)
+    return {name: labels[name] for name in by}
+
+def _key_space(by):
+    n = 1
+    for name in by:
+        n *= _KEYS[name][0]
+    return n
+
+def _max_drawdown(keys, ts, pnl):
+    """Largest peak-to-trough drop of cumulative P&L (from 0) per group, in time order."""
+    if len(keys) == 0:
+        return {}
+    order = None if np.all(ts[1:] >= ts[:-1]) else np.argsort(ts, kind="stable")
+    if order is not None:
+        keys, pnl = keys[order], pnl[order]
+    by_group = np.argsort(keys.astype(np.int16), kind="stable")  # radix sort; key space < 2**15
+    g, pnl = keys[by_group], pnl[by_group].astype(np.float64)
+    uniq = np.flatnonzero(np.bincount(g))
+    g = np.searchsorted(uniq, g)
+    cs = np.cumsum(pnl)
+    starts = np.flatnonzero(np.r_[True, g[1:] != g[:-1]])
+    cs -= np.repeat(np.r_[0.0, cs[starts[1:] - 1]], np.diff(np.r_[starts, len(g)]))
+    big = 2 * np.abs(cs).max() + 1
+    peak = np.maximum(np.maximum.accumulate(cs + g * big) - g * big, 0.0)
+    dd = np.zeros(len(uniq))
+    np.maximum.at(dd, g, peak - cs)
+    return dict(zip(uniq.tolist(), dd.tolist()))
+
+def report(days=90, by=("asset", "hour"), bid_price=0.25, directory=COLUMNS_DIR):
+    """
+    Fill rate, win rate, realized edge and drawdown per group over the last `days`.
+    edge = size-weighted average payout per token minus average buy price; a bid at
+    `bid_price` breaks even at a win rate of `bid_price`.
+    """
+    t0 = time.perf_counter()
+    by = tuple(by)
+    since = time.time() - days * 86400 if days else None
+    bids, fills, trades = (load(t, since, directory) for t in ("bids", "fills", "closed"))
+    exits = trades["exit"]
+    filled = (exits != UNFILLED_EXITS[0]) & (exits != UNFILLED_EXITS[1])
+    rows = {}
+
+    def row(key):
+        if key not in rows:
+            rows[key] = {**_decode(key, by), "bids": 0, "fills": 0, "trades": 0, "wins": 0,
+                         "pnl": 0.0, "tokens": 0.0, "paid": 0.0, "payout": 0.0, "max_drawdown": 0.0}
+        return rows[key]
+
+    space = _key_space(by)
+    for table, field in ((bids, "bids"), (fills, "fills")):
+        counts = np.bincount(_group_keys(table, by), minlength=space)
+        for k in np.flatnonzero(counts).tolist():
+            row(k)[field] = int(counts[k])
+
+    keys = _group_keys(trades, by)[filled]
+    trade_pnl = trades["pnl"][filled]
+    exit_price = trades["exit_price"][filled]
+    size = trades["size"][filled].astype(np.float64)
+    won = (exit_price >= 0.99) | (exits[filled] == EXITS.index("won"))
+    counts = np.bincount(keys, minlength=space)
+    wins = np.bincount(keys, weights=won, minlength=space)
+    pnl = np.bincount(keys, weights=trade_pnl, minlength=space)
+    tokens = np.bincount(keys, weights=size, minlength=space)
+    paid = np.bincount(keys, weights=size * trades["price"][filled], minlength=space)
+    payout = np.bincount(keys, weights=size * exit_price, minlength=space)
+    for i in np.flatnonzero(counts).tolist():
+        r = row(i)
+        r.update(trades=int(counts[i]), wins=int(wins[i]), pnl=float(pnl[i]),
+                 tokens=float(tokens[i]), paid=float(paid[i]), payout=float(payout[i]))
+    for k, dd in _max_drawdown(keys, trades["ts"][filled], trade_pnl).items():
+        row(k)["max_drawdown"] = dd
+
+    out = []
+    for k in sorted(rows):
+        r = rows[k]
+        tokens = r.pop("tokens")
+        paid, payout = r.pop("paid"), r.pop("payout")
+        r["fill_rate"] = round(r["fills"] / r["bids"], 4) if r["bids"] else None
+        r["win_rate"] = round(r["wins"] / r["trades"], 4) if r["trades"] else None
+        r["avg_buy"] = round(paid / tokens, 4) if tokens else None
+        r["avg_payout"] = round(payout / tokens, 4) if tokens else None
+        r["edge"] = round((payout - paid) / tokens, 4) if tokens else None
+        r["win_rate_vs_breakeven"] = round(r["win_rate"] - bid_price, 4) if r["win_rate"] is not None else None
+        r["pnl"] = round(r["pnl"], 2)
+        r["max_drawdown"] = round(r["max_drawdown"], 2)
+        out.append(r)
+    return {"days": days, "by": list(by), "bid_price": bid_price,
+            "records": {"bids": len(bids), "fills": len(fills), "trades": int(filled.sum())},
+            "rows": out, "query_ms": round((time.perf_counter() - t0) * 1000, 2)}
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Trade-history analytics over the columnar export")
+    ap.add_argument("--days", type=float, default=90, help="look-back window (0 = all history)")
+    ap.add_argument("--by", default="asset,hour", help="comma-separated group keys: asset, side, hour")
+    ap.add_argument("--bid-price", type=float, default=0.25)
+    ap.add_argument("--dir", default=COLUMNS_DIR)
+    ap.add_argument("--json", action="store_true", help="print raw JSON")
+    a = ap.parse_args(argv)
+    by = [b for b in a.by.split(",") if b]
+    unknown = [b for b in by if b not in _KEYS]
+    if unknown:
+        ap.error("unknown group key(s): %s" % ", ".join(unknown))
+    res = report(a.days, by, a.bid_price, a.dir)
+    if a.json:
+        print(json.dumps(res, indent=2))
+        return
+    cols = by + ["bids", "fills", "fill_rate", "trades", "win_rate", "edge", "pnl", "max_drawdown"]
+    print("  ".join("%-10s" % c for c in cols))
+    for r in res["rows"]:
+        print("  ".join("%-10s" % ("-" if r[c] is None else r[c]) for c in cols))
+    print("%d bids / %d fills / %d trades in %.1f ms" % (
+        res["records"]["bids"], res["records"]["fills"], res["records"]["trades"], res["query_ms"]))
+
+if __name__ == "__main__":
+    sys.exit(main())
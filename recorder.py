@@ -0,0 +1,140 @@
+"""
+L2 order-book recorder — fixed-size memory-mapped ring of top-N depth snapshots and trades.
+
+Records are written in place into the mapped file (no intermediate buffers). The ring is split
+into segments; each segment the writer leaves is gzip-compressed into DATA_DIR/book/ by
+flush_segments() (called off the trading thread), and old segment files are deleted to stay
+inside the disk budget. load_range() reads segments plus the live ring into one NumPy array.
+"""
+import os, re, gzip, mmap, struct, threading
+import numpy as np
+
+DEPTH = 10
+KIND_BOOK, KIND_TRADE = 0, 1
+
+RECORD = np.dtype([
+    ("ts", "<f8"), ("token", "<u8"), ("kind", "u1"), ("n_bids", "u1"), ("n_asks", "u1"), ("_pad", "u1", (5,)),
+    ("last", "<f4"), ("bid_px", "<f4", (DEPTH,)), ("bid_sz", "<f4", (DEPTH,)),
+    ("ask_px", "<f4", (DEPTH,)), ("ask_sz", "<f4", (DEPTH,)),
+])
+
+_HEADER = struct.Struct("<8sIIQQQQ")  # magic, version, record size, capacity, segment, write idx, flushed idx
+_HEADER_SIZE = 64
+_MAGIC = b"BOOKRING"
+_SEGMENT_RE = re.compile(r"seg_(\d+)_(\d+)_(\d+)\.bin\.gz$")
+
+def token_key(token_id):
+    """Records store the low 64 bits of the (77-digit) CLOB token id."""
+    return int(token_id) & 0xFFFFFFFFFFFFFFFF
+
+def _levels(levels, descending):
+    return sorted(((float(l.price), float(l.size)) for l in levels), reverse=descending)[:DEPTH]
+
+class BookRing:
+    def __init__(self, directory, segment_records=4096, segments=8, disk_budget=512 * 2**20):
+        self.directory = directory
+        self.disk_budget = disk_budget
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, "ring.mmap")
+        capacity = segment_records * segments
+        size = _HEADER_SIZE + capacity * RECORD.itemsize
+        fresh = not os.path.exists(path) or os.path.getsize(path) != size
+        with open(path, "a+b") as f:
+            f.truncate(size)
+            self.mm = mmap.mmap(f.fileno(), size)
+        header = _HEADER.unpack_from(self.mm, 0)
+        if fresh or header[:5] != (_MAGIC, 1, RECORD.itemsize, capacity, segment_records):
+            _HEADER.pack_into(self.mm, 0, _MAGIC, 1, RECORD.itemsize, capacity, segment_records, 0, 0)
+            header = _HEADER.unpack_from(self.mm, 0)
+        self.capacity, self.segment = capacity, segment_records
+        self.write_index, self.flushed_index = header[5], header[6]
+        self.rec = np.ndarray((capacity,), dtype=RECORD, buffer=self.mm, offset=_HEADER_SIZE)
+
+    def _store_header(self):
+        struct.pack_into("<QQ", self.mm, 32, self.write_index, self.flushed_index)
+
+    def append(self, token_id, ts, kind=KIND_BOOK, bids=(), asks=(), last=0.0):
+        """Write one record straight into the mapped ring. bids/asks are [(price, size)], best first."""
+        with self.lock:
+            r = self.rec[self.write_index % self.capacity]  # structured scalar = view into the mmap
+            r["ts"], r["token"], r["kind"], r["last"] = ts, token_key(token_id), kind, last
+            r["n_bids"], r["n_asks"] = len(bids), len(asks)
+            for side, levels in (("bid", bids), ("ask", asks)):
+                px, sz = r[side + "_px"], r[side + "_sz"]
+                px[:] = 0
+                sz[:] = 0
+                for j, (p, s) in enumerate(levels):
+                    px[j], sz[j] = p, s
+            self.write_index += 1
+            self._store_header()
+
+    def append_book(self, token_id, book, ts):
+        """Record a py_clob_client OrderBookSummary (top DEPTH levels per side)."""
+        bids = _levels(book.bids or [], True)
+        asks = _levels(book.asks or [], False)
+        last = float(book.last_trade_price or 0)
+        self.append(token_id, ts, KIND_BOOK, bids, asks, last)
+
+    def flush_segments(self):
+        """Compress every segment the writer has left behind, then enforce the disk budget."""
+        while True:
+            with self.lock:
+                start = self.flushed_index
+                if start + self.segment > self.write_index:
+                    break
+                if start < self.write_index - self.capacity:  # lapped before it could be saved
+                    self.flushed_index = (self.write_index - self.capacity) // self.segment * self.segment + self.segment
+                    self._store_header()
+                    continue
+                i = start % self.capacity
+                seg = self.rec[i:i + self.segment].copy()
+            if seg["ts"].any():
+                name = "seg_%012d_%d_%d.bin.gz" % (start // self.segment, int(seg["ts"].min()),
+                                                    int(seg["ts"].max()) + 1)
+                tmp = os.path.join(self.directory, name + ".tmp")
+                with gzip.open(tmp, "wb", compresslevel=6) as f:
+                    f.write(seg.tobytes())
+                os.replace(tmp, os.path.join(self.directory, name))
+            with self.lock:
+                self.flushed_index = start + self.segment
+                self._store_header()
+        self._enforce_budget()
+
+    def _enforce_budget(self):
+        files = sorted(f for f in os.listdir(self.directory) if _SEGMENT_RE.match(f))
+        sizes = {f: os.path.getsize(os.path.join(self.directory, f)) for f in files}
+        total = sum(sizes.values())
+        for f in files:
+            if total <= self.disk_budget:
+                break
+            os.remove(os.path.join(self.directory, f))
+            total -= sizes[f]
+
+def load_range(directory, t0, t1, token_id=None):
+    """All records with t0 <= ts < t1 (optionally for one token), from segment files and the live ring."""
+    parts = []
+    for f in sorted(os.listdir(directory)):
+        m = _SEGMENT_RE.match(f)
+        if m and int(m.group(2)) < t1 and int(m.group(3)) > t0:
+            with gzip.open(os.path.join(directory, f), "rb") as fh:
+                parts.append(np.frombuffer(fh.read(), dtype=RECORD))
+    path = os.path.join(directory, "ring.mmap")
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, _, rsize, capacity, _, write, flushed = _HEADER.unpack_from(mm, 0)
+        if magic == _MAGIC and rsize == RECORD.itemsize:
+            ring = np.ndarray((capacity,), dtype=RECORD, buffer=mm, offset=_HEADER_SIZE)
+            idx = np.arange(max(flushed, write - capacity), write) % capacity
+            parts.append(ring[idx])  # fancy indexing copies, so the mmap can be released
+            del ring
+        mm.close()
+    if not parts:
+        return np.zeros(0, dtype=RECORD)
+    rec = np.concatenate(parts)
+    mask = (rec["ts"] >= t0) & (rec["ts"] < t1)
+    if token_id is not None:
+        mask &= rec["token"] == token_key(token_id)
+    rec = rec[mask]
+    return rec[np.argsort(rec["ts"], kind="stable")]
@@ -1,46 +1,193 @@
 """
 Crypto Scalper v9 — Data API reconciliation + Builder relayer (gasless)
 """
-import os, json, time, logging, threading, requests
+import os, sys, json, gzip, hmac, math, mmap, time, atexit, socket, struct, hashlib, logging, threading, queue, traceback, \
+    subprocess, socketserver, requests
+from urllib.parse import urlsplit
+from logging.handlers import QueueHandler, QueueListener
+from collections import deque, Counter
+from itertools import islice, chain
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
 from datetime import datetime, timezone
 from dotenv import load_dotenv
 from flask import Flask, request as flask_request, jsonify, Response
-from web3 import Web3
-from py_clob_client.client import ClobClient
-from py_clob_client.clob_types import (
-    OrderArgs, OrderType, CreateOrderOptions,
-    BalanceAllowanceParams, AssetType,
-)
-from py_clob_client.order_builder.constants import BUY, SELL
-from py_clob_client.constants import POLYGON
+from werkzeug.exceptions import BadRequest
 import httpx
+# web3 and py_clob_client are imported inside the functions that use them: they are
+# the bulk of import time, and init_clients() loads them in parallel with its RPC checks.
+# analytics and recorder (numpy) are imported where they start, so only the engine and
+# /api/analytics pay for them.
 
 load_dotenv()
 
+# ── HTTP routing ──
+# Only the CLOB endpoints that need a residential IP (order entry, cancels, API-key auth)
+# go through the proxy; book reads, Gamma, Data API and RPC go direct. Proxy, direct CLOB
+# and Gamma/Data API each keep their own connection pool, and every request's latency is
+# recorded per route (metrics["routes"] in /api/status).
+
 _RAW_PROXY = os.getenv("RESIDENTIAL_PROXY_URL") or os.getenv("PROXY_URL") or ""
-if _RAW_PROXY and "-country-" not in _RAW_PROXY:
-    _PROXY_URL = _RAW_PROXY.replace("residential_proxy1:", "residential_proxy1-country-gb:")
+PROXY_COUNTRY = os.getenv("SCALP_PROXY_COUNTRY", "gb")  # empty = leave the proxy URL as given
+if _RAW_PROXY and PROXY_COUNTRY and "-country-" not in _RAW_PROXY:
+    _PROXY_URL = _RAW_PROXY.replace("residential_proxy1:", "residential_proxy1-country-%s:" % PROXY_COUNTRY)
 else:
     _PROXY_URL = _RAW_PROXY
-if _PROXY_URL:
-    _OrigClient = httpx.Client
-    class _ProxiedClient(_OrigClient):
-        def __init__(self, **kwargs):
-            if "proxy" not in kwargs and "proxies" not in kwargs:
-                kwargs["proxy"] = _PROXY_URL
-            super().__init__(**kwargs)
-    httpx.Client = _ProxiedClient
-
-logging.basicConfig(level=logging.INFO, format="%(asctime)s  %(levelname)s  %(message)s", datefmt="%H:%M:%S")
+# CLOB paths sent through the proxy: exact paths, or prefixes when ending in "/"
+PROXY_PATHS = tuple(p for p in os.getenv("SCALP_PROXY_PATHS", "/order,/orders,/cancel-all,/cancel-market-orders,/auth/").split(",") if p)
+PROXY_ALL = os.getenv("SCALP_PROXY_ALL") == "1"  # old behaviour: every CLOB call via the proxy
+
+route_stats = {}  # "via METHOD host/path" -> [count, total s, last s, max s, errors]
+_route_lock = threading.Lock()
+
+def _route_key(via, method, url):
+    u = urlsplit(str(url))
+    path = "/".join(":id" if seg.isdigit() or seg.startswith("0x") or len(seg) > 24 else seg
+                    for seg in u.path.split("/"))
+    return "%s %s %s%s" % (via, method, u.hostname, path)
+
+def record_route(key, seconds, ok):
+    with _route_lock:
+        st = route_stats.setdefault(key, [0, 0.0, 0.0, 0.0, 0])
+        st[0] += 1
+        st[1] += seconds
+        st[2] = seconds
+        st[3] = max(st[3], seconds)
+        st[4] += not ok
+
+def route_metrics():
+    with _route_lock:
+        return {k: {"n": n, "avg_ms": round(total / n * 1000, 1), "last_ms": round(last * 1000, 1),
+                    "max_ms": round(peak * 1000, 1), "errors": errors}
+                for k, (n, total, last, peak, errors) in route_stats.items()}
+
+def needs_proxy(path):
+    return PROXY_ALL or any(path.startswith(p) if p.endswith("/") else path == p for p in PROXY_PATHS)
+
+class RoutingTransport(httpx.BaseTransport):
+    """httpx transport for the CLOB client: proxy or direct pool per request path, timed per route."""
+
+    def __init__(self):
+        self.direct = httpx.HTTPTransport(http2=True)
+        self.proxied = httpx.HTTPTransport(http2=True, proxy=_PROXY_URL) if _PROXY_URL else None
+
+    def handle_request(self, request):
+        via = "proxy" if self.proxied and needs_proxy(request.url.path) else "direct"
+        t0, ok = time.perf_counter(), False
+        try:
+            resp = (self.proxied if via == "proxy" else self.direct).handle_request(request)
+            ok = resp.status_code < 500
+            return resp
+        finally:
+            record_route(_route_key(via, request.method, request.url), time.perf_counter() - t0, ok)
+
+    def close(self):
+        self.direct.close()
+        if self.proxied:
+            self.proxied.close()
+
+def install_http_routing():
+    """Swap py_clob_client's module-level httpx client for one on RoutingTransport."""
+    from py_clob_client.http_helpers import helpers
+    helpers._http_client = httpx.Client(transport=RoutingTransport())
+
+api_session = requests.Session()  # Gamma + Data API, direct
+api_session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+def api_get(url, **kwargs):
+    t0, ok = time.perf_counter(), False
+    try:
+        r = api_session.get(url, **kwargs)
+        ok = r.status_code < 500
+        return r
+    finally:
+        record_route(_route_key("direct", "GET", url), time.perf_counter() - t0, ok)
+
+def rpc_call(method, *params):
+    """Raw JSON-RPC call to RPC_URL on the shared session (web3 is not needed for log queries)."""
+    t0, ok = time.perf_counter(), False
+    try:
+        r = api_session.post(RPC_URL, json={"jsonrpc": "2.0", "id": 1, "method": method, "params": list(params)}, timeout=10)
+        r.raise_for_status()
+        body = r.json()
+        if body.get("error"):
+            raise RuntimeError("%s: %s" % (method, body["error"].get("message", body["error"])))
+        ok = True
+        return body["result"]
+    finally:
+        record_route(_route_key("direct", "POST", RPC_URL) + " " + method, time.perf_counter() - t0, ok)
+
+# ── Logging ──
+# Callers only enqueue records; a listener thread formats them, writes stdout and keeps
+# the last EVENTS_KEEP as structured events for /api/events. Position fields ride along
+# via extra=pos_fields(p). If the queue backs up, records are dropped and counted.
+
+LOG_FORMAT = os.getenv("SCALP_LOG_FORMAT", "text")  # "json" for one JSON object per line
+EVENTS_KEEP = 5000
+EVENT_FIELDS = ("token_id", "order_id", "condition_id", "strategy", "asset", "side", "status", "exit_type", "pnl")
+events = deque(maxlen=EVENTS_KEEP)
+
+def log_event(record):
+    e = {"ts": round(record.created, 3), "level": record.levelname, "logger": record.name, "msg": record.getMessage()}
+    for k in EVENT_FIELDS:
+        v = getattr(record, k, None)
+        if v is not None:
+            e[k] = v
+    return e
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(log_event(record))
+
+class EventRingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.next_id = 0
+
+    def emit(self, record):
+        if record.name.startswith("werkzeug"):  # access log lines (request URLs) stay on stdout only
+            return
+        e = log_event(record)
+        e["id"] = self.next_id
+        self.next_id += 1
+        events.append(e)
+
+class DroppingQueueHandler(QueueHandler):
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def pos_fields(p):
+    return {"token_id": p.token_id, "order_id": p.buy_order_id, "condition_id": p.condition_id, "strategy": p.strategy,
+            "asset": p.asset, "side": p.side, "status": p.status, "exit_type": p.exit_type, "pnl": p.pnl}
+
+_stdout_handler = logging.StreamHandler(sys.stdout)
+_stdout_handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else
+                             logging.Formatter("%(asctime)s  %(levelname)s  %(message)s", datefmt="%H:%M:%S"))
+log_queue = DroppingQueueHandler(queue.Queue(maxsize=10000))
+log_queue.setFormatter(logging.Formatter("%(message)s"))  # prepare() renders only the message (plus traceback)
+_log_listener = QueueListener(log_queue.queue, _stdout_handler, EventRingHandler(), respect_handler_level=True)
+logging.basicConfig(level=logging.INFO, handlers=[log_queue])
+_log_listener.start()
+atexit.register(_log_listener.stop)
 log = logging.getLogger("scalper")
 
 PRIVATE_KEY = os.getenv("PRIVATE_KEY")
 BID_PRICE = 0.25
 BID_AMOUNT = 5.0
-POLL_SECONDS = 15
+POLL_SECONDS = 15  # busy poll: markets still missing or a deadline passed unsettled
+IDLE_POLL_SECONDS = int(os.getenv("SCALP_IDLE_POLL_SECONDS", "60"))  # longest sleep between scheduled wakes
+CLOCK_SYNC_INTERVAL = 600  # seconds between CLOB server-time offset refreshes
+WAKE_DELAY = 0.5  # wake this long after a slot boundary / deadline so the exchange has crossed it too
 MIN_TIME_LEFT = 120
 PORT = int(os.getenv("SCALP_PORT", "8081"))
 ASSETS = ["eth", "btc", "sol"]
+STRATEGIES_CONFIG = os.getenv("SCALP_STRATEGIES", "")  # JSON list of strategies; empty = one both-sides $0.25 bidder
 CLOB_HOST = "https://clob.polymarket.com"
 GAMMA_API = "https://gamma-api.polymarket.com"
 DATA_API = "https://data-api.polymarket.com"
@@ -51,6 +198,8 @@ USDC_ADDRESS = "0x2791Bca1f2de4661ED88A30C99A7a9449Aa84174"
 CTF_ABI = [
     {"inputs":[{"name":"account","type":"address"},{"name":"id","type":"uint256"}],
      "name":"balanceOf","outputs":[{"name":"","type":"uint256"}],"stateMutability":"view","type":"function"},
+    {"inputs":[{"name":"accounts","type":"address[]"},{"name":"ids","type":"uint256[]"}],
+     "name":"balanceOfBatch","outputs":[{"name":"","type":"uint256[]"}],"stateMutability":"view","type":"function"},
     {"inputs":[{"name":"collateralToken","type":"address"},{"name":"parentCollectionId","type":"bytes32"},
                 {"name":"conditionId","type":"bytes32"},{"name":"indexSets","type":"uint256[]"}],
      "name":"redeemPositions","outputs":[],"stateMutability":"nonpayable","type":"function"},
@@ -62,11 +211,46 @@ CTF_ABI = [
 DATA_DIR = os.getenv("DATA_DIR", "/app/data")
 POSITIONS_FILE = os.path.join(DATA_DIR, "scalp_positions.json")
 CLOSED_FILE = os.path.join(DATA_DIR, "scalp_closed.json")
+CLOSED_HISTORY_FILE = os.path.join(DATA_DIR, "scalp_closed_history.jsonl")
+COLUMNS_DIR = os.path.join(DATA_DIR, "columns")
+BOOK_DIR = os.path.join(DATA_DIR, "book")
+BOOK_RECORD_SECONDS = float(os.getenv("SCALP_BOOK_RECORD_SECONDS", "5"))  # 0 disables the book recorder
+BOOK_DISK_BUDGET_MB = int(os.getenv("SCALP_BOOK_DISK_MB", "512"))
+LEDGER_FILE = os.path.join(DATA_DIR, "scalp_ledger.jsonl")
+INIT_CACHE_FILE = os.path.join(DATA_DIR, "scalp_init_cache.json")
+RESOLUTION_FILE = os.path.join(DATA_DIR, "scalp_resolution.json")
+CLOSED_WINDOW = 500  # closed trades kept in memory / in CLOSED_FILE; older ones live only in the history file
 
 BUILDER_KEY = os.getenv("POLY_BUILDER_API_KEY", "")
 BUILDER_SECRET = os.getenv("POLY_BUILDER_SECRET", "")
 BUILDER_PASSPHRASE = os.getenv("POLY_BUILDER_PASSPHRASE", "")
-RECONCILE_INTERVAL = 120  # seconds between Data API reconciliation sweeps
+RECONCILE_MIN_INTERVAL = 60  # Data API reconciliation: sweep this often while positions are changing,
+RECONCILE_MAX_INTERVAL = 900  # backing off (doubling) up to this when a sweep finds nothing new
+RECONCILE_SIZE_THRESHOLD = 1  # ignore dust positions below this many tokens
+DATA_API_PAGE = 500
+VALUE_REFRESH = 60  # seconds between portfolio value / gas balance refreshes
+WINNER_RECHECK = 60  # seconds before asking Gamma again about an unresolved market
+# keccak("ConditionResolution(bytes32,address,bytes32,uint256,uint256[])"), emitted by the CTF for neg-risk markets too
+CONDITION_RESOLUTION_TOPIC = "0xb44d84d3289691f71497564b85d4233648d9dbae8cbdbb4329f301c3a0185894"
+OUTCOMES = ("Up", "Down")  # outcome slot order of the up/down markets (payout vector index)
+RESOLUTION_LOOKBACK = 1800  # blocks scanned on first start (~1h on Polygon)
+RESOLUTION_SPAN = 1000  # blocks per eth_getLogs request
+RESOLUTION_MAX_SPANS = 10  # requests per tick while catching up
+RESOLUTION_CONFIRMATIONS = 3  # stay this many blocks behind head
+RESOLUTION_STALE = 300  # seconds without a successful scan before falling back to per-position polling
+RESOLUTION_FALLBACK = 6 * 3600  # after this long past window end, poll the position anyway (resolved before the cursor)
+RESOLUTION_RECHECK = 300  # seconds between those fallback polls
+LEDGER_RETENTION_HOURS = 24 * 400  # hourly P&L buckets kept for /api/stats range queries
+LEDGER_SAVE_INTERVAL = 15  # seconds between ledger appends; history replay covers anything unsaved
+COMMAND_TIMEOUT = 60  # seconds an API request waits for the engine to apply its command
+TOMBSTONE_KEEP = 500  # removed-position markers kept for /api/status?since= deltas
+GZIP_MIN_BYTES = 1024
+DASHBOARD_MODE = os.getenv("SCALP_DASHBOARD", "thread")  # "process": HTTP served by separate worker processes
+DASHBOARD_WORKERS = int(os.getenv("SCALP_DASHBOARD_WORKERS", "2"))
+SNAPSHOT_PATH = os.getenv("SCALP_SNAPSHOT_PATH", "/dev/shm/scalp_snapshot" if os.path.isdir("/dev/shm") else
+                          os.path.join(DATA_DIR, "scalp_snapshot.mmap"))
+SNAPSHOT_SLOT_MB = int(os.getenv("SCALP_SNAPSHOT_MB", "8"))  # per slot; the file holds two
+COMMAND_SOCKET = os.getenv("SCALP_COMMAND_SOCKET", os.path.join(DATA_DIR, "scalp.sock"))
 
 clob = None
 w3 = None
@@ -84,11 +268,300 @@ ERC20_ABI = [
 relay_client = None
 bot_paused = False
 positions = []
-closed = []
-stats = {"wins": 0, "losses": 0, "pnl": 0.0}
-cache = {"bal": 0, "bids": {}, "last_reconcile": 0}
+closed = deque(maxlen=CLOSED_WINDOW)
+cache = {"bal": 0, "bids": {}, "last_reconcile": 0, "reconcile_interval": RECONCILE_MIN_INTERVAL, "recon_fp": {},
+         "trade_pnl": 0.0,
+         "portfolio_value": 0, "gas_balance": 0, "last_value_refresh": 0,
+         "winners": {}, "winner_checked": {}, "closed_count": 0}
+metrics = {"started_at": time.time(), "startup_s": None, "time_to_first_bid_s": None, "clock_offset_s": 0.0,
+           "tick_ms": 0.0, "tick_overruns": 0}
+trade_export = None  # analytics.ColumnWriter once start_trade_export() runs
+init_cache = {}  # derived API creds + approval / Safe-deployed flags, persisted in INIT_CACHE_FILE
+_init_cache_lock = threading.Lock()
 flask_app = Flask(__name__)
 
+# ── Engine state ownership ──
+# positions / closed / ledger / cache belong to the run() thread. Other threads
+# read `snapshot` (rebuilt and swapped in whole by the engine, never mutated
+# after publish) and change state only by queueing commands for the engine.
+
+# Every publish bumps `seq`, which starts at the process start time in ms so it keeps
+# increasing across restarts. `ver` records the seq at which each status field, position
+# and recent closed trade last changed, plus tombstones for removed positions, so
+# /api/status?since=<seq> can return only what changed.
+
+STATUS_FIELDS = ("bal", "paused", "stats", "gas_balance", "wallet", "metrics")
+
+commands = queue.Queue()
+_seq0 = int(metrics["started_at"] * 1000)
+snapshot = {
+    "seq": _seq0, "bal": 0, "paused": False, "pos": (), "closed": (),
+    "stats": {"wins": 0, "losses": 0, "pnl": 0.0, "trade_pnl": 0.0, "open_cost": 0,
+              "portfolio_value": 0, "builder_relayer": False},
+    "gas_balance": 0, "wallet": "", "metrics": {}, "ledger": None, "closed_count": 0,
+    "ver": {"fields": dict.fromkeys(STATUS_FIELDS, _seq0), "pos": {}, "gone": {}, "closed": (), "floor": _seq0},
+}
+
+def publish_snapshot():
+    """Copy engine state into a fresh snapshot and swap it in atomically."""
+    global snapshot
+    prev, seq = snapshot, snapshot["seq"] + 1
+    totals = ledger["all"]["all"]
+    pos = []
+    for p in positions:
+        d = p.to_dict()
+        d["bid"] = cache["bids"].get(p.token_id)
+        pos.append(d)
+    n_closed = min(len(closed), 50)
+    s = {
+        "seq": seq,
+        "bal": cache["bal"],
+        "paused": bot_paused,
+        "pos": tuple(pos),
+        "closed": tuple(c.to_dict() for c in islice(closed, len(closed) - n_closed, None)),
+        "stats": {
+            "wins": totals["wins"],
+            "losses": totals["losses"],
+            "pnl": totals["pnl"],
+            "trade_pnl": cache["trade_pnl"],
+            "open_cost": sum(p.cost for p in positions if p.status in ("held", "pending")),
+            "portfolio_value": cache["portfolio_value"],
+            "builder_relayer": relay_client is not None,
+        },
+        "gas_balance": cache["gas_balance"],
+        "wallet": w3_account.address if w3_account else "",
+        "metrics": {**metrics, "routes": route_metrics(), "stages": {k: dict(v) for k, v in stage_stats.items()},
+                    "strategies": {name: dict(st.metrics) for name, st in strategies.items()}},
+        "ledger": {"all": ledger["all"], "buckets": ledger["buckets"]},
+        "closed_count": cache["closed_count"],
+    }
+    old, ver = {d["token_id"]: d for d in prev["pos"]}, prev["ver"]
+    pos_ver, gone, floor = {}, dict(ver["gone"]), ver["floor"]
+    for d in pos:
+        t = d["token_id"]
+        pos_ver[t] = ver["pos"][t] if old.get(t) == d else seq
+        gone.pop(t, None)
+    for t in old:
+        if t not in pos_ver:
+            gone[t] = seq
+    while len(gone) > TOMBSTONE_KEEP:
+        floor = max(floor, gone.pop(next(iter(gone))))
+    added = s["closed_count"] - prev["closed_count"]
+    s["ver"] = {
+        "fields": {k: ver["fields"][k] if prev[k] == s[k] else seq for k in STATUS_FIELDS},
+        "pos": pos_ver,
+        "gone": gone,
+        "closed": ((seq,) * n_closed + ver["closed"] + (seq,) * added)[-n_closed:] if n_closed else (),
+        "floor": floor,
+    }
+    snapshot = s
+    if shm_writer:
+        shm_writer.publish(s)
+
+def submit_command(fn, *args):
+    """Queue fn(*args) for the engine thread and wait for its result dict."""
+    if remote:
+        return engine_call(fn.__name__, *args)
+    fut = Future()
+    commands.put((fn, args, fut))
+    try:
+        return fut.result(timeout=COMMAND_TIMEOUT)
+    except FutureTimeout:
+        return {"err": "Engine busy — command still queued"}
+
+def apply_commands(timeout=0):
+    """Run queued API commands on the engine thread; blocks up to timeout waiting for more."""
+    deadline = time.time() + timeout
+    while True:
+        try:
+            fn, args, fut = commands.get(timeout=max(0, deadline - time.time()))
+        except queue.Empty:
+            return
+        try:
+            result = fn(*args)
+        except Exception as e:
+            log.error("Command %s failed: %s", fn.__name__, e)
+            result = {"err": str(e)}
+        fut.set_result(result)
+        publish_snapshot()
+
+# ── Out-of-process dashboard ──
+# With SCALP_DASHBOARD=process the engine serves no HTTP. publish_snapshot() also writes the
+# snapshot as JSON into a memory-mapped file (two slots behind a seqlock counter: the writer
+# fills the idle slot, then flips the header), and a Unix socket accepts commands. Dashboard
+# workers (`python scalper.py --dashboard`) share one listening socket, read the snapshot
+# without touching the engine, and send commands over the socket. The ledger is not in the
+# shared snapshot; workers read scalp_ledger.jsonl instead.
+
+_SHM_HEADER = struct.Struct("<8sQQQQ")  # magic, counter (odd while the header changes), slot, length, slot size
+_SHM_HEADER_SIZE = 64
+_SHM_MAGIC = b"SCALPSNP"
+ENGINE_OPS = ("cmd_set_paused", "cmd_reconcile", "cmd_sell", "cmd_cancel", "query_events", "withdraw", "profile")
+
+remote = False  # True in dashboard worker processes
+shm_writer = None
+
+class SnapshotWriter:
+    def __init__(self, path, slot_size):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        size = _SHM_HEADER_SIZE + 2 * slot_size
+        with open(path, "a+b") as f:
+            f.truncate(size)
+            self.mm = mmap.mmap(f.fileno(), size)
+        self.slot_size, self.counter, self.slot = slot_size, 0, 1
+        _SHM_HEADER.pack_into(self.mm, 0, _SHM_MAGIC, 0, 0, 0, slot_size)
+
+    def publish(self, snap):
+        data = json.dumps({k: v for k, v in snap.items() if k != "ledger"}, separators=(",", ":")).encode()
+        if len(data) > self.slot_size:
+            log.error("Snapshot %d bytes exceeds SCALP_SNAPSHOT_MB, not shared", len(data))
+            return
+        slot = 1 - self.slot
+        off = _SHM_HEADER_SIZE + slot * self.slot_size
+        struct.pack_into("<Q", self.mm, 8, self.counter + 1)  # odd: readers retry until the header is settled
+        self.mm[off:off + len(data)] = data
+        struct.pack_into("<QQ", self.mm, 16, slot, len(data))
+        struct.pack_into("<Q", self.mm, 8, self.counter + 2)
+        self.counter, self.slot = self.counter + 2, slot
+
+class SnapshotReader:
+    """Latest engine snapshot from the shared file, parsed only when the counter moves."""
+
+    def __init__(self, path):
+        self.path, self.mm, self.counter, self.snap = path, None, None, None
+
+    def read(self):
+        if self.mm is None:
+            try:
+                with open(self.path, "rb") as f:
+                    self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                return None
+        for _ in range(100):
+            magic, c1, slot, length, slot_size = _SHM_HEADER.unpack_from(self.mm, 0)
+            if magic != _SHM_MAGIC or c1 == 0:
+                return self.snap
+            if c1 == self.counter:
+                return self.snap
+            if c1 % 2:
+                time.sleep(0.001)
+                continue
+            off = _SHM_HEADER_SIZE + slot * slot_size
+            data = self.mm[off:off + length]
+            if struct.unpack_from("<Q", self.mm, 8)[0] != c1:  # a publish started meanwhile
+                continue
+            try:
+                snap = json.loads(data)
+            except ValueError:
+                continue
+            self.snap, self.counter = snap, c1
+            return self.snap
+        return self.snap
+
+snapshot_reader = SnapshotReader(SNAPSHOT_PATH)
+
+def current_snapshot():
+    if not remote:
+        return snapshot
+    return snapshot_reader.read() or snapshot
+
+_ledger_file = {"ino": None, "pos": 0, "view": None}
+
+def current_ledger(s):
+    """
+    Ledger trees for /api/stats: from the snapshot in-process, from LEDGER_FILE in a worker.
+    Workers read only the records appended since the last request, from the start after a rewrite.
+    """
+    if not remote:
+        return s["ledger"]
+    lf = _ledger_file
+    try:
+        with open(LEDGER_FILE, "rb") as f:
+            st = os.fstat(f.fileno())
+            if st.st_ino != lf["ino"] or st.st_size < lf["pos"]:
+                lf.update(ino=st.st_ino, pos=0, view={"all": None, "buckets": {}, "offset": 0})
+            if st.st_size > lf["pos"]:
+                view = dict(lf["view"], buckets=dict(lf["view"]["buckets"]))
+                f.seek(lf["pos"])
+                lf["pos"] += _ledger_read(view, f)
+                lf["view"] = view
+    except OSError:
+        return None
+    return lf["view"] if lf["view"]["all"] is not None else None
+
+class _CommandHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            req = json.loads(self.rfile.readline())
+            op, args = req["op"], req.get("args", [])
+            if op not in ENGINE_OPS:
+                out = {"err": "Unknown command %s" % op}
+            elif op.startswith("cmd_"):
+                out = submit_command(globals()[op], *args)
+            else:
+                out = globals()[op](*args)
+        except Exception as e:
+            out = {"err": str(e)}
+        self.wfile.write(json.dumps(out).encode() + b"\n")
+
+def start_command_server():
+    """Unix socket for dashboard workers: engine commands go through the command queue, queries run here."""
+    try:
+        os.unlink(COMMAND_SOCKET)
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(COMMAND_SOCKET), exist_ok=True)
+    srv = socketserver.ThreadingUnixStreamServer(COMMAND_SOCKET, _CommandHandler)
+    srv.daemon_threads = True
+    os.chmod(COMMAND_SOCKET, 0o600)
+    threading.Thread(target=srv.serve_forever, name="commands", daemon=True).start()
+
+def engine_call(op, *args):
+    """Run an ENGINE_OPS entry in the engine process (from a dashboard worker)."""
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(COMMAND_TIMEOUT + 5)
+            sock.connect(COMMAND_SOCKET)
+            sock.sendall(json.dumps({"op": op, "args": list(args)}).encode() + b"\n")
+            return json.loads(sock.makefile("rb").readline())
+    except (OSError, ValueError) as e:
+        return {"err": "Engine unreachable: %s" % e, "unreachable": True}
+
+def engine_query(fn, *args):
+    return engine_call(fn.__name__, *args) if remote else fn(*args)
+
+def start_dashboard_workers():
+    """Bind the HTTP port once and run DASHBOARD_WORKERS worker processes accepting on it; dead workers are restarted."""
+    global shm_writer
+    shm_writer = SnapshotWriter(SNAPSHOT_PATH, SNAPSHOT_SLOT_MB * 2**20)
+    start_command_server()
+    sock = socket.create_server(("0.0.0.0", PORT), backlog=128)
+    fd = sock.fileno()
+    cmd = [sys.executable, os.path.abspath(__file__), "--dashboard", "--fd", str(fd)]
+    workers = [None] * DASHBOARD_WORKERS
+
+    def supervise():
+        while True:
+            for i, w in enumerate(workers):
+                if w is None or w.poll() is not None:
+                    if w is not None:
+                        log.warning("Dashboard worker %d exited (%s), restarting", i, w.returncode)
+                    workers[i] = subprocess.Popen(cmd, pass_fds=(fd,))
+            time.sleep(5)
+
+    atexit.register(lambda: [w.terminate() for w in workers if w and w.poll() is None])
+    threading.Thread(target=supervise, name="dashboard-workers", daemon=True).start()
+    log.info("Dashboard: %d worker processes on :%d, snapshot %s", DASHBOARD_WORKERS, PORT, SNAPSHOT_PATH)
+
+def serve_dashboard(fd=None):
+    """Dashboard worker process: serve the Flask app from the shared snapshot."""
+    global remote
+    from werkzeug.serving import make_server
+    remote = True
+    srv = make_server("0.0.0.0", PORT, flask_app, threaded=True, fd=fd)
+    log.info("Dashboard worker pid %d serving :%d", os.getpid(), PORT)
+    srv.serve_forever()
+
 # ── Persistence ──
 
 def load_json(path, default):
@@ -100,10 +573,395 @@ def save_json(path, data):
     os.makedirs(os.path.dirname(path), exist_ok=True)
     with open(path, "w") as f: json.dump(data, f, indent=2)
 
+def save_positions():
+    save_json(POSITIONS_FILE, [p.to_dict() for p in positions])
+
+def save_closed():
+    save_json(CLOSED_FILE, [c.to_dict() for c in closed])
+
+def record_closed(p):
+    """Move a finished position into the in-memory window, book it in the ledger and append it to the on-disk history."""
+    closed.append(p)
+    cache["closed_count"] += 1
+    outcome = _trade_outcome(p)
+    if outcome:
+        strategy_tally(p, closed=1, wins=outcome == "win", pnl=p.pnl or 0)
+    ledger_book(p)
+    export_trade_event("closed", p)
+    os.makedirs(DATA_DIR, exist_ok=True)
+    with open(CLOSED_HISTORY_FILE, "ab") as f:
+        f.write((json.dumps(p.to_dict()) + "\n").encode())
+        ledger["offset"] = f.tell()
+
+def read_closed_page(before=None, limit=50):
+    """
+    Page closed trades newest-first out of the history file without loading it.
+    `before` is the byte-offset cursor returned by the previous page (None = newest).
+    Returns (records, next_cursor); next_cursor is None once the start of the file is reached.
+    """
+    records = []
+    try:
+        with open(CLOSED_HISTORY_FILE, "rb") as f:
+            end = f.seek(0, os.SEEK_END)
+            if before is not None:
+                end = min(int(before), end)
+            start, buf = end, b""  # buf always holds bytes [start, end)
+            while end > 0 and len(records) < limit:
+                i = buf.rfind(b"\n", 0, len(buf) - 1)
+                if i < 0 and start > 0:
+                    step = min(65536, start)
+                    start -= step
+                    f.seek(start)
+                    buf = f.read(step) + buf
+                    continue
+                line, buf = buf[i + 1:], buf[:i + 1]
+                end -= len(line)
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    pass  # blank or half-written line
+    except FileNotFoundError:
+        return [], None
+    return records, (end or None)
+
+# ── Columnar trade export (see analytics.py) ──
+
+def start_trade_export():
+    global trade_export
+    try:
+        import analytics  # needs numpy
+    except ImportError:
+        log.info("Trade export: disabled (numpy not installed)")
+        return
+    trade_export = analytics.ColumnWriter(COLUMNS_DIR)
+
+def _export_add(table, p, ts=None):
+    trade_export.add(table, ts or time.time(), p.end_ts, p.asset, p.side, p.buy_price, p.size,
+                     exit_type=p.exit_type, exit_price=p.exit_price, cost=p.cost, pnl=p.pnl, fee=p.fee)
+
+def export_trade_event(table, p, ts=None):
+    """Append one row and write it out at once, so a restart between ticks loses nothing."""
+    if trade_export:
+        _export_add(table, p, ts)
+        flush_trade_export()
+
+def backfill_trade_export():
+    """First run with the export: seed bids / fills / closed tables from the closed history file."""
+    if not trade_export or trade_export.exists():
+        return
+    def ts_of(iso):
+        try: return datetime.fromisoformat(iso).timestamp()
+        except (TypeError, ValueError): return 0.0
+    try:
+        with open(CLOSED_HISTORY_FILE) as f:
+            for line in f:
+                try:
+                    c = Position.from_dict(json.loads(line))
+                except ValueError:
+                    continue
+                placed = ts_of(c.placed_at)
+                if c.buy_order_id and c.buy_order_id != "adopted":
+                    _export_add("bids", c, placed)
+                    if c.exit_type not in ("cancelled", "expired"):
+                        _export_add("fills", c, placed)
+                _export_add("closed", c, ts_of(c.closed_at))
+    except FileNotFoundError:
+        pass
+    for rows in trade_export.pending.values():
+        rows.sort(key=lambda r: r[0])
+    trade_export.flush()
+    log.info("Trade export seeded from history under %s", COLUMNS_DIR)
+
+def flush_trade_export():
+    if trade_export:
+        try:
+            trade_export.flush()
+        except OSError as e:
+            log.warning("Trade export flush failed: %s", e)
+
+# ── Position records ──
+
+class Position:
+    """One bid/position/closed trade. Slotted instead of a ~20-key dict; asset, side and status are interned."""
+    __slots__ = ("token_id", "buy_order_id", "buy_price", "size", "cost", "side", "asset", "title", "slug",
+                 "market_id", "condition_id", "tick_size", "neg_risk", "end_ts", "sell_order_id", "sell_price",
+                 "status", "placed_at", "source", "exit_type", "exit_price", "pnl", "closed_at", "fee", "strategy")
+    _INTERNED = ("side", "asset", "status", "exit_type", "source", "strategy")
+
+    def __init__(self, **fields):
+        for k in self.__slots__:
+            v = fields.get(k)
+            if k in self._INTERNED and isinstance(v, str):
+                v = sys.intern(v)
+            setattr(self, k, v)
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(**d)
+
+    def to_dict(self):
+        return {k: getattr(self, k) for k in self.__slots__}
+
+# ── P&L ledger ──
+# Running aggregates updated once per closed trade. An aggregate tree holds totals plus
+# breakdowns by asset / side / window (quarter-hour the market window opened) / hour-of-day
+# (UTC, close time). "all" covers all time; "buckets" maps epoch-hour -> tree for range
+# queries. Trees are copied on update, never mutated, so snapshots can share them.
+# LEDGER_FILE is append-only JSON lines: each save appends the all-time tree plus the buckets
+# changed since the last one (null = pruned), and the file is rewritten as one full record
+# once the appends outgrow it.
+
+_DIMS = ("asset", "side", "window", "hour")
+
+def _agg():
+    return {"trades": 0, "wins": 0, "losses": 0, "pnl": 0.0, "fees": 0.0, "cost": 0.0}
+
+def _agg_tree():
+    return {"all": _agg(), **{d: {} for d in _DIMS}}
+
+ledger = {"all": _agg_tree(), "buckets": {}, "dirty": set(), "offset": 0,  # offset: history bytes booked
+          "saved_at": 0, "base": 0}  # base: size of the last full write (0 = rewrite on next save)
+
+def _trade_outcome(p):
+    """'win' / 'loss' for a filled trade, None for a bid that closed without filling."""
+    if p.exit_type in ("cancelled", "expired"):
+        return None
+    if p.exit_type == "won":
+        return "win"
+    if p.exit_type in ("lost", "resolved"):
+        return "loss"
+    return "win" if (p.pnl or 0) >= 0 else "loss"
+
+def _agg_add(agg, p, outcome):
+    a = dict(agg) if agg else _agg()
+    if outcome:
+        a["trades"] += 1
+        a["wins" if outcome == "win" else "losses"] += 1
+        a["cost"] = round(a["cost"] + (p.cost or 0), 2)
+    a["pnl"] = round(a["pnl"] + (p.pnl or 0), 2)
+    a["fees"] = round(a["fees"] + (p.fee or 0), 4)
+    return a
+
+def _tree_add(tree, p, outcome, keys):
+    t = dict(tree) if tree else _agg_tree()
+    t["all"] = _agg_add(t["all"], p, outcome)
+    for dim, key in keys.items():
+        t[dim] = dict(t[dim])
+        t[dim][key] = _agg_add(t[dim].get(key), p, outcome)
+    return t
+
+def _merge_agg(into, name, agg):
+    tot = into.setdefault(name, _agg())
+    for k, v in agg.items():
+        tot[k] = round(tot[k] + v, 4)
+
+def _tree_merge(into, tree):
+    _merge_agg(into, "all", tree["all"])
+    for d in _DIMS:
+        for k, a in tree.get(d, {}).items():
+            _merge_agg(into, f"{d}:{k}", a)
+
+def _ledger_prune(buckets, hour):
+    """Drop buckets older than LEDGER_RETENTION_HOURS before `hour`."""
+    cutoff = hour - LEDGER_RETENTION_HOURS
+    for h in [h for h in buckets if h < cutoff]:
+        del buckets[h]
+        ledger["dirty"].add(h)
+
+def ledger_book(p, closed_ts=None, buckets=None):
+    """
+    Fold one closed trade into the running aggregates. Replays pass their own `buckets` dict,
+    updated in place and published once, instead of copying the published one per trade.
+    """
+    outcome = _trade_outcome(p)
+    ts = closed_ts or time.time()
+    window = "%02d" % ((((p.end_ts or 0) - 900) % 3600) // 60) if p.end_ts else "?"
+    hour = int(ts // 3600)
+    keys = {"asset": p.asset or "?", "side": p.side or "?", "window": window}
+    ledger["all"] = _tree_add(ledger["all"], p, outcome, {**keys, "hour": "%02d" % (hour % 24)})
+    publish = buckets is None
+    if publish:
+        buckets = dict(ledger["buckets"])
+    if publish and hour not in buckets:  # new hour (replays prune once at the end)
+        _ledger_prune(buckets, hour)
+    buckets[hour] = _tree_add(buckets.get(hour), p, outcome, keys)
+    ledger["dirty"].add(hour)
+    if publish:
+        ledger["buckets"] = buckets
+
+def ledger_range(view, since=None, until=None):
+    """Sum hourly buckets in [since, until) into totals and per-dimension breakdowns (no history scan)."""
+    if since is None and until is None:
+        merged = {}
+        _tree_merge(merged, view["all"])
+    else:
+        lo = int(since // 3600) if since is not None else None
+        hi = int(-(-until // 3600)) if until is not None else None
+        merged = {}
+        for h, tree in view["buckets"].items():
+            if (lo is None or h >= lo) and (hi is None or h < hi):
+                _tree_merge(merged, tree)
+                _merge_agg(merged, "hour:%02d" % (h % 24), tree["all"])
+    out = {"totals": merged.get("all", _agg())}
+    for d in _DIMS:
+        out[f"by_{d}"] = {name.split(":", 1)[1]: agg for name, agg in sorted(merged.items())
+                          if name.startswith(d + ":")}
+    return out
+
+def save_ledger(force=False):
+    """Append the changes to LEDGER_FILE at most every LEDGER_SAVE_INTERVAL; rewrite it whole once appends outgrow it."""
+    if ledger["base"] and not ledger["dirty"]:
+        return
+    if not force and time.time() - ledger["saved_at"] < LEDGER_SAVE_INTERVAL:
+        return
+    ledger["saved_at"] = time.time()
+    dirty, ledger["dirty"] = ledger["dirty"], set()
+    try:
+        size = os.path.getsize(LEDGER_FILE)
+    except OSError:
+        size = 0
+    full = not ledger["base"] or not size or size - ledger["base"] > max(ledger["base"], 1 << 20)
+    buckets = ledger["buckets"]
+    rec = {"offset": ledger["offset"], "all": ledger["all"],
+           "buckets": {str(h): buckets.get(h) for h in (buckets if full else dirty)}}
+    line = (json.dumps(rec, separators=(",", ":")) + "\n").encode()
+    os.makedirs(DATA_DIR, exist_ok=True)
+    if full:
+        with open(LEDGER_FILE + ".tmp", "wb") as f:
+            f.write(line)
+        os.replace(LEDGER_FILE + ".tmp", LEDGER_FILE)
+        ledger["base"] = len(line)
+    else:
+        with open(LEDGER_FILE, "ab") as f:
+            f.write(line)
+
+def _ledger_read(view, f):
+    """Apply LEDGER_FILE records from f's position onto view; returns the bytes consumed (whole records only)."""
+    used = 0
+    for line in f:
+        try:
+            if not line.endswith(b"\n"):  # partial last line from a crash mid-write
+                break
+            rec = json.loads(line)
+        except ValueError:
+            break
+        used += len(line)
+        view["all"], view["offset"] = rec["all"], rec["offset"]
+        for h, t in rec["buckets"].items():
+            if t is None:
+                view["buckets"].pop(int(h), None)
+            else:
+                view["buckets"][int(h)] = t
+    return used
+
+def load_ledger():
+    """
+    Restore aggregates and book any history lines appended after the last save (trades closed
+    between a save and a restart). Without a saved ledger, or if the history file was replaced,
+    build them from the whole closed history file. The file is then rewritten compacted.
+    """
+    view = {"all": None, "buckets": {}, "offset": 0}
+    try:
+        with open(LEDGER_FILE, "rb") as f:
+            _ledger_read(view, f)
+    except OSError:
+        pass
+    try:
+        size = os.path.getsize(CLOSED_HISTORY_FILE)
+    except OSError:
+        size = 0
+    offset = 0
+    if view["all"] is not None and view["offset"] <= size:
+        ledger["all"], ledger["buckets"], offset = view["all"], view["buckets"], view["offset"]
+    n = _replay_history(offset)
+    if n:
+        log.info("Ledger: booked %d closed trades from history", n)
+    ledger["base"] = 0
+    save_ledger(force=True)
+
+def _replay_history(offset):
+    ledger["offset"] = offset
+    buckets = dict(ledger["buckets"])
+    n = 0
+    try:
+        with open(CLOSED_HISTORY_FILE, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):  # partial last line from a crash mid-write
+                    break
+                ledger["offset"] += len(line)
+                try:
+                    c = Position.from_dict(json.loads(line))
+                except ValueError:
+                    continue
+                try:
+                    ts = datetime.fromisoformat(c.closed_at).timestamp()
+                except (TypeError, ValueError):
+                    ts = None
+                ledger_book(c, ts, buckets)
+                n += 1
+    except FileNotFoundError:
+        pass
+    if buckets:
+        _ledger_prune(buckets, max(buckets))
+    ledger["buckets"] = buckets
+    return n
+
+# ── Clock & scheduling ──
+# Slot math and deadlines use CLOB server time. The loop sleeps until the next slot
+# boundary, pending-bid cutoff or resolution check, and at most IDLE_POLL_SECONDS.
+
+clock = {"offset": 0.0, "synced_at": 0}
+
+def server_now():
+    return time.time() + clock["offset"]
+
+def sync_clock():
+    if time.time() - clock["synced_at"] < CLOCK_SYNC_INTERVAL:
+        return
+    try:
+        t0 = time.time()
+        server = float(clob.get_server_time())
+        t1 = time.time()
+    except Exception as e:
+        log.debug("Server time fetch failed: %s", e)
+        return
+    clock["offset"] = server + 0.5 - (t0 + t1) / 2  # whole seconds on the server: assume mid-second
+    clock["synced_at"] = t1
+    if abs(clock["offset"] - metrics["clock_offset_s"]) >= 1:
+        log.info("Clock offset vs CLOB: %+.1fs", clock["offset"])
+    metrics["clock_offset_s"] = round(clock["offset"], 1)
+
+def next_wake(markets):
+    """Seconds until the next scheduled event, and what it is."""
+    now = server_now()
+    slot_end = (int(now) // 900 + 1) * 900
+    wakes = [(slot_end + WAKE_DELAY, "slot"), (now + IDLE_POLL_SECONDS, "idle")]
+    busy = len(markets) < len(discovery_assets) * sum(1 for s in (slot_end - 900, slot_end) if s + 900 - now >= MIN_TIME_LEFT)
+    for p in positions:
+        due = p.end_ts - 30 if p.status == "pending" else p.end_ts + 60 if p.status == "held" else None
+        if due is None:
+            continue
+        if p.status == "held" and now > due and not resolution_due(p, claim=False):
+            # the resolution watcher covers it; wake for the fallback poll only
+            due = max(p.end_ts + RESOLUTION_FALLBACK,
+                      resolution["checked"].get(p.token_id, 0) + RESOLUTION_RECHECK + clock["offset"])
+        if now > due:
+            busy = True
+        else:
+            wakes.append((due + WAKE_DELAY, "%s %s %s" % (p.asset, p.side, "bid cutoff" if p.status == "pending" else "resolution")))
+    reconcile_due = cache["last_reconcile"] + cache["reconcile_interval"] + clock["offset"]
+    if reconcile_due > now:
+        wakes.append((reconcile_due + WAKE_DELAY, "reconcile"))
+    if busy:
+        wakes.append((now + POLL_SECONDS, "poll"))
+    at, why = min(wakes)
+    return max(0.0, at - now), why
+
 # ── Market discovery ──
 
 def find_current_markets():
-    now = int(time.time())
+    now = int(server_now())
     current_slot = (now // 900) * 900
     next_slot = current_slot + 900
     markets = []
@@ -112,10 +970,10 @@ def find_current_markets():
         time_left = window_end - now
         if time_left < MIN_TIME_LEFT:
             continue
-        for asset in ASSETS:
+        for asset in discovery_assets:
             slug = f"{asset}-updown-15m-{slot}"
             try:
-                r = requests.get(f"{GAMMA_API}/events", params={"slug": slug}, timeout=5)
+                r = api_get(f"{GAMMA_API}/events", params={"slug": slug}, timeout=5)
                 data = r.json()
                 if not data:
                     continue
@@ -148,10 +1006,14 @@ def find_current_markets():
 
 # ── Balance helpers ──
 
+def collateral_balance():
+    """USDC balance from the CLOB; raises on API/auth errors."""
+    from py_clob_client.clob_types import BalanceAllowanceParams, AssetType
+    b = clob.get_balance_allowance(BalanceAllowanceParams(asset_type=AssetType.COLLATERAL))
+    return int(b.get("balance", 0)) / 1e6
+
 def usdc_balance():
-    try:
-        b = clob.get_balance_allowance(BalanceAllowanceParams(asset_type=AssetType.COLLATERAL))
-        return int(b.get("balance", 0)) / 1e6
+    try: return collateral_balance()
     except Exception: return 0.0
 
 def token_balance_onchain(token_id):
@@ -162,12 +1024,25 @@ def token_balance_onchain(token_id):
         log.warning("On-chain balance failed %s: %s", str(token_id)[:20], e)
         return -1
 
+def token_balances_onchain(token_ids, raw=False):
+    """On-chain balances of many tokens in one balanceOfBatch call: {token_id: shares} ({} if the RPC fails)."""
+    ids = list(dict.fromkeys(token_ids))
+    if not ids:
+        return {}
+    try:
+        bals = ctf_contract.functions.balanceOfBatch([w3_account.address] * len(ids), [int(t) for t in ids]).call()
+    except Exception as e:
+        log.warning("On-chain batch balance failed (%d tokens): %s", len(ids), e)
+        return {}
+    return {t: b if raw else b // 1_000_000 for t, b in zip(ids, bals)}
+
 def token_balance(token_id):
     """On-chain first, CLOB fallback only if RPC fails."""
     onchain = token_balance_onchain(token_id)
     if onchain >= 0:
         return onchain
     try:
+        from py_clob_client.clob_types import BalanceAllowanceParams, AssetType
         b = clob.get_balance_allowance(BalanceAllowanceParams(asset_type=AssetType.CONDITIONAL, token_id=token_id))
         return int(b.get("balance", 0)) // 1_000_000
     except Exception:
@@ -175,20 +1050,24 @@ def token_balance(token_id):
 
 # ── Data API (Polymarket's authoritative position tracker) ──
 
-def data_api_positions():
-    """Fetch open positions from Polymarket Data API — the source of truth."""
-    try:
-        r = requests.get(f"{DATA_API}/positions", params={"user": w3_account.address.lower()}, timeout=10)
-        if r.status_code == 200:
-            return r.json()
-    except Exception as e:
-        log.debug("Data API positions error: %s", e)
-    return []
+def data_api_positions(**filters):
+    """Stream the wallet's positions from the Data API, one page per request; raises on a failed page."""
+    params = {"user": w3_account.address.lower(), "sizeThreshold": RECONCILE_SIZE_THRESHOLD,
+              "limit": DATA_API_PAGE, **filters}
+    offset = 0
+    while True:
+        r = api_get(f"{DATA_API}/positions", params={**params, "offset": offset}, timeout=10)
+        r.raise_for_status()
+        page = r.json()
+        yield from page
+        if len(page) < DATA_API_PAGE:
+            return
+        offset += len(page)
 
 def data_api_value():
     """Fetch total portfolio value from Data API."""
     try:
-        r = requests.get(f"{DATA_API}/value", params={"user": w3_account.address.lower()}, timeout=10)
+        r = api_get(f"{DATA_API}/value", params={"user": w3_account.address.lower()}, timeout=10)
         if r.status_code == 200:
             data = r.json()
             if data:
@@ -197,91 +1076,207 @@ def data_api_value():
         pass
     return 0
 
+def refresh_account_values():
+    """Refresh the slow-moving dashboard figures (portfolio value, gas) at most every VALUE_REFRESH."""
+    now = time.time()
+    if now - cache["last_value_refresh"] < VALUE_REFRESH:
+        return
+    cache["last_value_refresh"] = now
+    cache["portfolio_value"] = data_api_value()
+    try:
+        cache["gas_balance"] = round(w3.eth.get_balance(w3_account.address) / 1e18, 6)
+    except Exception as e:
+        log.debug("Gas balance error: %s", e)
+
 def reconcile_positions():
     """
     Compare bot's internal position list with Polymarket's Data API.
     Adopt any positions the bot lost track of and redeem any redeemable ones.
+    Entries whose (size, curPrice, redeemable) fingerprint is unchanged since they were last
+    handled are skipped. Sweeps back off unless one adopted, redeemed or left a retry, or an
+    entry appeared, vanished or changed size / redeemable (curPrice moves alone don't count).
     """
     now = time.time()
-    if now - cache.get("last_reconcile", 0) < RECONCILE_INTERVAL:
+    if now - cache["last_reconcile"] < cache["reconcile_interval"]:
         return
     cache["last_reconcile"] = now
 
-    api_positions = data_api_positions()
-    if not api_positions:
-        return
+    tracked_tokens = {p.token_id for p in positions}
+    before = (len(positions), cache["closed_count"])
+    old_fp, new_fp, active = cache["recon_fp"], {}, 0
+    try:
+        for ap in chain(data_api_positions(redeemable="true"), data_api_positions(redeemable="false")):
+            if stage_expired():
+                raise TimeoutError("stage deadline reached")
+            token_id = ap.get("asset", "")
+            fp = (ap.get("size"), ap.get("curPrice"), ap.get("redeemable"))
+            old = old_fp.get(token_id)
+            if old == fp:
+                new_fp[token_id] = fp
+                continue
+            result = _reconcile_entry(ap, tracked_tokens)
+            if result or old is None or (old[0], old[2]) != (fp[0], fp[2]):
+                active += 1
+            if result != "retry" and token_id:
+                new_fp[token_id] = fp
+    except Exception as e:
+        log.warning("Data API reconcile aborted: %s", e)
+        new_fp = {**old_fp, **new_fp}
+        active += 1
+    cache["recon_fp"] = new_fp
+    active += len(old_fp.keys() - new_fp.keys())
+    cache["reconcile_interval"] = RECONCILE_MIN_INTERVAL if active else \
+        min(RECONCILE_MAX_INTERVAL, cache["reconcile_interval"] * 2)
+    log.debug("Reconcile: %d entries active, next sweep in %ds", active, cache["reconcile_interval"])
 
-    tracked_tokens = {p["token_id"] for p in positions}
-    changed = False
+    if (len(positions), cache["closed_count"]) != before:
+        positions[:] = [p for p in positions if p.status != "done"]
+        save_positions()
+        save_closed()
 
-    for ap in api_positions:
-        token_id = ap.get("asset", "")
-        condition_id = ap.get("conditionId", "")
-        redeemable = ap.get("redeemable", False)
-        size = ap.get("size", 0)
-        outcome = ap.get("outcome", "")
-        title = ap.get("title", "")
-        slug = ap.get("slug", "")
-        cur_price = ap.get("curPrice", 0)
-
-        if redeemable and condition_id:
-            log.info("RECONCILE: redeemable position found — %s %s (%.0f tokens @ $%.2f)", title[:40], outcome, size, cur_price)
-            redeem_position(condition_id)
-            time.sleep(2)
-            actual = token_balance_onchain(token_id) if token_id else -1
-            if actual == 0:
-                pnl = round(size * 1.0 - size * float(ap.get("avgPrice", BID_PRICE)), 2)
-                closed.append({
-                    "token_id": token_id, "condition_id": condition_id,
-                    "side": outcome, "asset": slug.split("-")[0] if slug else "?",
-                    "title": title, "size": size, "cost": round(size * float(ap.get("avgPrice", BID_PRICE)), 2),
-                    "exit_type": "won" if cur_price >= 0.99 else "reconciled",
-                    "exit_price": cur_price, "pnl": pnl,
-                    "closed_at": datetime.now(timezone.utc).isoformat(),
-                    "source": "data_api_reconcile",
-                })
-                stats["pnl"] += pnl
-                stats["wins"] += 1
-                log.info("RECONCILE REDEEMED: %s %s | P&L $%+.2f", title[:40], outcome, pnl)
-                if token_id in tracked_tokens:
-                    positions[:] = [p for p in positions if p["token_id"] != token_id]
-                changed = True
-                continue
+def _reconcile_entry(ap, tracked_tokens):
+    """Redeem or adopt one Data API position: "redeemed", "adopted", "retry" (redeem pending) or None."""
+    token_id = ap.get("asset", "")
+    condition_id = ap.get("conditionId", "")
+    redeemable = ap.get("redeemable", False)
+    size = ap.get("size", 0)
+    outcome = ap.get("outcome", "")
+    title = ap.get("title", "")
+    slug = ap.get("slug", "")
+    cur_price = ap.get("curPrice", 0)
 
-        if token_id and token_id not in tracked_tokens and size > 0:
-            asset_name = slug.split("-")[0] if slug else "?"
-            end_ts_str = ap.get("endDate", "")
-            positions.append({
-                "token_id": token_id, "buy_order_id": "adopted",
-                "buy_price": float(ap.get("avgPrice", BID_PRICE)),
-                "size": int(size), "cost": round(size * float(ap.get("avgPrice", BID_PRICE)), 2),
-                "side": outcome, "asset": asset_name, "title": title, "slug": slug,
-                "market_id": "", "condition_id": condition_id,
-                "tick_size": 0.01, "neg_risk": ap.get("negativeRisk", False),
-                "end_ts": int(time.time()) + 900,
-                "sell_order_id": None, "sell_price": None, "status": "held",
-                "placed_at": datetime.now(timezone.utc).isoformat(),
-                "source": "data_api_adopted",
-            })
-            log.info("RECONCILE ADOPTED: %s %s — %.0f tokens (was untracked)", title[:40], outcome, size)
-            changed = True
+    if redeemable and condition_id:
+        log.info("RECONCILE: redeemable position found — %s %s (%.0f tokens @ $%.2f)", title[:40], outcome, size, cur_price,
+                 extra={"token_id": token_id, "condition_id": condition_id, "side": outcome})
+        redeem_position(condition_id)
+        time.sleep(2)
+        actual = token_balance_onchain(token_id) if token_id else -1
+        if actual == 0:
+            pnl = round(size * 1.0 - size * float(ap.get("avgPrice", BID_PRICE)), 2)
+            record_closed(Position(
+                token_id=token_id, condition_id=condition_id,
+                side=outcome, asset=slug.split("-")[0] if slug else "?",
+                title=title, size=size, cost=round(size * float(ap.get("avgPrice", BID_PRICE)), 2),
+                status="done", exit_type="won" if cur_price >= 0.99 else "reconciled",
+                exit_price=cur_price, pnl=pnl,
+                closed_at=datetime.now(timezone.utc).isoformat(),
+                source="data_api_reconcile",
+            ))
+            log.info("RECONCILE REDEEMED: %s %s | P&L $%+.2f", title[:40], outcome, pnl, extra=pos_fields(closed[-1]))
+            if token_id in tracked_tokens:
+                positions[:] = [p for p in positions if p.token_id != token_id]
+            return "redeemed"
 
-    if changed:
-        save_json(POSITIONS_FILE, positions)
-        save_json(CLOSED_FILE, closed[-500:])
+    if token_id and token_id not in tracked_tokens and size > 0:
+        asset_name = slug.split("-")[0] if slug else "?"
+        positions.append(Position(
+            token_id=token_id, buy_order_id="adopted",
+            buy_price=float(ap.get("avgPrice", BID_PRICE)),
+            size=int(size), cost=round(size * float(ap.get("avgPrice", BID_PRICE)), 2),
+            side=outcome, asset=asset_name, title=title, slug=slug,
+            market_id="", condition_id=condition_id,
+            tick_size=0.01, neg_risk=ap.get("negativeRisk", False),
+            end_ts=int(server_now()) + 900, status="held",
+            placed_at=datetime.now(timezone.utc).isoformat(),
+            source="data_api_adopted",
+        ))
+        log.info("RECONCILE ADOPTED: %s %s — %.0f tokens (was untracked)", title[:40], outcome, size,
+                 extra=pos_fields(positions[-1]))
+        tracked_tokens.add(token_id)
+        return "retry" if redeemable and condition_id else "adopted"
+    return "retry" if redeemable and condition_id else None
 
 # ── Order book helpers ──
 
+def _top_of_book(book):
+    bids = getattr(book, "bids", [])
+    asks = getattr(book, "asks", [])
+    return {"best_bid": float(bids[-1].price) if bids else 0, "best_ask": float(asks[0].price) if asks else 0}
+
 def get_book(token_id):
     try:
         book = clob.get_order_book(token_id)
-        bids = getattr(book, "bids", [])
-        asks = getattr(book, "asks", [])
-        return {"best_bid": float(bids[-1].price) if bids else 0, "best_ask": float(asks[0].price) if asks else 0}
+        record_book(token_id, book)
+        return _top_of_book(book)
     except Exception: return {"best_bid": 0, "best_ask": 0}
 
+def get_books(token_ids):
+    """Best bid/ask for many tokens with one get_order_books request: {token_id: {...}} ({} on failure)."""
+    ids = list(dict.fromkeys(token_ids))
+    if not ids:
+        return {}
+    try:
+        from py_clob_client.clob_types import BookParams
+        books = clob.get_order_books([BookParams(token_id=t) for t in ids])
+    except Exception as e:
+        log.warning("Batch book fetch failed (%d tokens): %s", len(ids), e)
+        return {}
+    out = {}
+    for b in books:
+        record_book(b.asset_id, b)
+        out[b.asset_id] = _top_of_book(b)
+    return out
+
+# ── Book recorder (see recorder.py) ──
+
+book_ring = None
+book_tokens = ()  # up/down tokens from the latest discovery; replaced whole by the engine
+
+def record_book(token_id, book):
+    if book_ring:
+        try:
+            book_ring.append_book(token_id, book, time.time())
+        except Exception as e:
+            log.debug("Book record fail %s: %s", str(token_id)[:20], e)
+
+def set_book_tokens(markets):
+    global book_tokens
+    book_tokens = tuple(t for m in markets for t in (m["up_token"], m["down_token"]))
+
+def book_recorder_loop():
+    """Snapshot every discovered token's book with one batch call per interval, off the trading thread."""
+    from py_clob_client.clob_types import BookParams
+    from recorder import KIND_TRADE
+    last_trade = {}
+    while True:
+        time.sleep(BOOK_RECORD_SECONDS)
+        tokens = book_tokens
+        last_trade = {t: last_trade[t] for t in tokens if t in last_trade}
+        if tokens and clob:
+            try:
+                books = clob.get_order_books([BookParams(token_id=t) for t in tokens])
+                now = time.time()
+                for b in books:
+                    book_ring.append_book(b.asset_id, b, now)
+                    ltp = float(b.last_trade_price or 0)
+                    if ltp and last_trade.get(b.asset_id) != ltp:
+                        last_trade[b.asset_id] = ltp
+                        book_ring.append(b.asset_id, now, KIND_TRADE, last=ltp)
+            except Exception as e:
+                log.debug("Book recorder error: %s", e)
+        try:
+            book_ring.flush_segments()
+        except OSError as e:
+            log.warning("Book segment flush failed: %s", e)
+
+def start_book_recorder():
+    global book_ring
+    if BOOK_RECORD_SECONDS <= 0:
+        log.info("Book recorder: disabled")
+        return
+    try:
+        import recorder  # needs numpy
+    except ImportError:
+        log.info("Book recorder: disabled (numpy not installed)")
+        return
+    book_ring = recorder.BookRing(BOOK_DIR, disk_budget=BOOK_DISK_BUDGET_MB * 2**20)
+    threading.Thread(target=book_recorder_loop, name="book-recorder", daemon=True).start()
+    log.info("Book recorder: every %.0fs -> %s (%d MB budget)", BOOK_RECORD_SECONDS, BOOK_DIR, BOOK_DISK_BUDGET_MB)
+
 def place_gtc_buy(token_id, price, size, tick, neg_risk):
     try:
+        from py_clob_client.clob_types import OrderArgs, OrderType, CreateOrderOptions
+        from py_clob_client.order_builder.constants import BUY
         args = OrderArgs(token_id=token_id, price=round(price, 2), size=int(size), side=BUY)
         signed = clob.create_order(args, options=CreateOrderOptions(tick_size=str(tick), neg_risk=neg_risk))
         r = clob.post_order(signed, OrderType.GTC)
@@ -292,6 +1287,8 @@ def place_gtc_buy(token_id, price, size, tick, neg_risk):
 
 def fak_sell(token_id, price, size, tick, neg_risk):
     try:
+        from py_clob_client.clob_types import OrderArgs, OrderType, CreateOrderOptions
+        from py_clob_client.order_builder.constants import SELL
         args = OrderArgs(token_id=token_id, price=round(price, 2), size=int(size), side=SELL)
         signed = clob.create_order(args, options=CreateOrderOptions(tick_size=str(tick), neg_risk=neg_risk))
         r = clob.post_order(signed, OrderType.FAK)
@@ -300,24 +1297,67 @@ def fak_sell(token_id, price, size, tick, neg_risk):
         log.error("FAK sell fail: %s", e)
         return ""
 
-def cancel_order(order_id):
-    try: clob.cancel(order_id); return True
-    except Exception: return False
+def cancel_orders(order_ids):
+    """Cancel a batch of orders in one request."""
+    if not order_ids:
+        return True
+    try:
+        r = clob.cancel_orders(list(order_ids))
+        failed = (r or {}).get("not_canceled") or {}
+        if failed:
+            log.warning("Not cancelled: %s", failed)
+        return True
+    except Exception as e:
+        log.error("Batch cancel of %d orders failed: %s", len(order_ids), e)
+        return False
+
+# ── Order sync (one open-orders + one trades query per cycle) ──
+
+orders = {"synced_at": 0, "open": None, "matched": {}, "fee": {}}
 
-def order_status(order_id):
+def sync_orders():
+    """Refresh open order ids and fills of our pending bids; replaces per-order get_order polling."""
+    from py_clob_client.clob_types import TradeParams
+    pending = [p for p in positions if p.status == "pending"]
+    if not pending:
+        orders.update(synced_at=time.time(), open=set(), matched={}, fee={})
+        return
+    started = time.time()
     try:
-        o = clob.get_order(order_id)
-        if o:
-            s = o.get("status", "")
-            if s in ("MATCHED", "FILLED"): return "FILLED"
-            if s in ("INVALID", "CANCELLED"): return "CANCELLED"
-            return s
-    except Exception: pass
-    return "UNKNOWN"
+        live = {o["id"] for o in clob.get_orders()}
+        ours = {p.buy_order_id for p in pending}
+        placed = [datetime.fromisoformat(p.placed_at).timestamp() for p in pending if p.placed_at]
+        since = min(placed) if placed else started - 3600
+        matched, fee = {}, {}
+        for t in clob.get_trades(TradeParams(after=int(since) - 60)):
+            if t.get("status") == "FAILED":
+                continue
+            fills = [(t.get("taker_order_id"), t.get("size"), t.get("price"), t.get("fee_rate_bps"))]
+            fills += [(m.get("order_id"), m.get("matched_amount"), m.get("price"), m.get("fee_rate_bps"))
+                      for m in t.get("maker_orders") or []]
+            for oid, size, price, bps in fills:
+                if oid in ours:
+                    size, price = float(size or 0), float(price or 0)
+                    matched[oid] = matched.get(oid, 0) + size
+                    fee[oid] = fee.get(oid, 0) + float(bps or 0) / 10000 * min(price, 1 - price) * size
+    except Exception as e:
+        log.warning("Order sync failed: %s", e)
+        orders.update(synced_at=0, open=None, matched={}, fee={})
+        return
+    orders.update(synced_at=started, open=live, matched=matched, fee=fee)
+
+def order_status(p):
+    """FILLED / LIVE / CANCELLED for a tracked bid from the last sync; UNKNOWN if it is newer than the sync."""
+    if orders["open"] is None or not p.placed_at or \
+            datetime.fromisoformat(p.placed_at).timestamp() > orders["synced_at"]:
+        return "UNKNOWN"
+    if p.buy_order_id in orders["open"]:
+        return "LIVE"
+    return "FILLED" if orders["matched"].get(p.buy_order_id) else "CANCELLED"
 
 def get_market_winner(market_id):
     try:
-        r = requests.get(f"{GAMMA_API}/markets/{market_id}", timeout=5)
+        r = api_get(f"{GAMMA_API}/markets/{market_id}", timeout=5)
         mdata = r.json()
         winner = mdata.get("winnerOutcome")
         if winner:
@@ -337,45 +1377,80 @@ def get_market_winner(market_id):
 
 # ── Position lifecycle ──
 
-def check_and_close_position(p, exit_reason):
-    actual = token_balance(p["token_id"])
+def close_position(p, exit_type, exit_price, pnl):
+    """Mark p done with its exit and book it (history, ledger, export); callers drop it from positions."""
+    p.status = "done"
+    p.exit_type = exit_type
+    p.exit_price = exit_price
+    p.pnl = pnl
+    p.closed_at = datetime.now(timezone.utc).isoformat()
+    record_closed(p)
+
+def mark_filled(p, size):
+    p.size = size
+    p.status = "held"
+    strategy_tally(p, fills=1)
+    p.fee = round(orders["fee"].get(p.buy_order_id, p.fee or 0), 4)
+    export_trade_event("fills", p)
+
+def _needs_cancel(p, exit_reason, onchain=None):
+    """
+    False if the bid turned out filled (now held) or its state is unknown; True if it must be
+    cancelled. `onchain` is the token's balance from a batch read (None = read it here).
+    """
+    actual = token_balance(p.token_id) if onchain is None else onchain
     if actual > 0:
-        p["size"] = actual
-        p["status"] = "held"
-        log.info("ACTUALLY FILLED %s %s: %d @ $%.2f (was %s)", p["asset"].upper(), p["side"], actual, p["buy_price"], exit_reason)
+        mark_filled(p, actual)
+        log.info("ACTUALLY FILLED %s %s: %d @ $%.2f (was %s)", p.asset.upper(), p.side, actual, p.buy_price, exit_reason, extra=pos_fields(p))
         return False
-    st = order_status(p["buy_order_id"])
+    st = order_status(p)
     if st == "FILLED":
-        actual2 = token_balance_onchain(p["token_id"])
+        actual2 = token_balance_onchain(p.token_id) if onchain is None else onchain
         if actual2 > 0:
-            p["size"] = actual2
-            p["status"] = "held"
-            log.info("ORDER FILLED %s %s (on-chain %d)", p["asset"].upper(), p["side"], actual2)
+            mark_filled(p, actual2)
+            log.info("ORDER FILLED %s %s (on-chain %d)", p.asset.upper(), p.side, actual2, extra=pos_fields(p))
             return False
-        p["status"] = "held"
-        p["size"] = int(p.get("cost", BID_AMOUNT) / p.get("buy_price", BID_PRICE))
-        log.info("ORDER FILLED %s %s (CLOB=filled, keeping held)", p["asset"].upper(), p["side"])
+        mark_filled(p, int(p.cost / p.buy_price))
+        log.info("ORDER FILLED %s %s (CLOB=filled, keeping held)", p.asset.upper(), p.side, extra=pos_fields(p))
         return False
-    if st == "UNKNOWN":
-        log.warning("STATUS UNKNOWN %s %s, keeping position", p["asset"].upper(), p["side"])
+    if st == "UNKNOWN" and exit_reason != "cancelled":
+        log.warning("STATUS UNKNOWN %s %s, keeping position", p.asset.upper(), p.side, extra=pos_fields(p))
         return False
-    cancel_order(p["buy_order_id"])
+    return True
+
+def check_and_close_positions(ps, exit_reason):
+    """
+    Close unfilled bids with one batch cancel; returns the positions that were closed. Balances
+    are read with one balanceOfBatch before and one after the cancel (per token if it fails).
+    """
+    bals = token_balances_onchain(p.token_id for p in ps)
+    to_cancel = [p for p in ps if _needs_cancel(p, exit_reason, bals.get(p.token_id))]
+    if not to_cancel:
+        return []
+    cancel_orders([p.buy_order_id for p in to_cancel])
     time.sleep(1)
-    recheck = token_balance_onchain(p["token_id"])
+    bals = token_balances_onchain(p.token_id for p in to_cancel)
+    return [p for p in to_cancel if _close_cancelled(p, exit_reason, bals.get(p.token_id))]
+
+def _close_cancelled(p, exit_reason, recheck=None):
+    if recheck is None:
+        recheck = token_balance_onchain(p.token_id)
     if recheck > 0:
-        p["size"] = recheck
-        p["status"] = "held"
-        log.info("POST-CANCEL RECOVERY %s %s: %d tokens on-chain", p["asset"].upper(), p["side"], recheck)
+        mark_filled(p, recheck)
+        log.info("POST-CANCEL RECOVERY %s %s: %d tokens on-chain", p.asset.upper(), p.side, recheck, extra=pos_fields(p))
         return False
-    p["status"] = "done"
-    p["exit_type"] = exit_reason
-    p["pnl"] = 0
-    p["exit_price"] = 0
-    p["closed_at"] = datetime.now(timezone.utc).isoformat()
-    closed.append(p)
-    log.info("%s %s %s (confirmed 0 on-chain)", exit_reason.upper(), p["asset"].upper(), p["side"])
+    p.status = "done"
+    p.exit_type = exit_reason
+    p.pnl = 0
+    p.exit_price = 0
+    p.closed_at = datetime.now(timezone.utc).isoformat()
+    record_closed(p)
+    log.info("%s %s %s (confirmed 0 on-chain)", exit_reason.upper(), p.asset.upper(), p.side, extra=pos_fields(p))
     return True
 
+def check_and_close_position(p, exit_reason):
+    return bool(check_and_close_positions([p], exit_reason))
+
 # ── Redemption (gasless via Builder relayer when available, else direct tx) ──
 
 def _redeem_via_relayer(condition_id, token_id=None):
@@ -387,7 +1462,7 @@ def _redeem_via_relayer(condition_id, token_id=None):
         amounts = [bal, 0]  # try as Yes outcome
         redeem_data = neg_risk_adapter.encode_abi(
             abi_element_identifier="redeemPositions",
-            args=[Web3.to_bytes(hexstr=condition_id), amounts]
+            args=[w3.to_bytes(hexstr=condition_id), amounts]
         )
         tx = SafeTransaction(
             to=NEG_RISK_ADAPTER,
@@ -398,9 +1473,9 @@ def _redeem_via_relayer(condition_id, token_id=None):
         response = relay_client.execute([tx], f"Redeem {condition_id[:16]}")
         result = response.wait()
         if result:
-            log.info("REDEEMED (gasless) condition %s...", condition_id[:16])
+            log.info("REDEEMED (gasless) condition %s...", condition_id[:16], extra={"condition_id": condition_id, "token_id": token_id})
             return True
-        log.error("RELAYER REDEEM FAILED %s...", condition_id[:16])
+        log.error("RELAYER REDEEM FAILED %s...", condition_id[:16], extra={"condition_id": condition_id, "token_id": token_id})
         return False
     except Exception as e:
         log.error("RELAYER REDEEM ERROR: %s — falling back to direct tx", e)
@@ -415,7 +1490,7 @@ def _redeem_direct(condition_id, token_id=None):
         bal = ctf_contract.functions.balanceOf(w3_account.address, int(token_id)).call() if token_id else 0
         amounts = [bal, 0]  # try as Yes outcome
         tx = neg_risk_adapter.functions.redeemPositions(
-            Web3.to_bytes(hexstr=condition_id),
+            w3.to_bytes(hexstr=condition_id),
             amounts,
         ).build_transaction({
             "from": w3_account.address, "nonce": nonce, "gas": 400_000,
@@ -426,9 +1501,9 @@ def _redeem_direct(condition_id, token_id=None):
         tx_hash = w3.eth.send_raw_transaction(signed.raw_transaction)
         receipt = w3.eth.wait_for_transaction_receipt(tx_hash, timeout=90)
         if receipt.status == 1:
-            log.info("REDEEMED (direct) condition %s...", condition_id[:16])
+            log.info("REDEEMED (direct) condition %s...", condition_id[:16], extra={"condition_id": condition_id, "token_id": token_id})
             return True
-        log.error("REDEEM REVERTED %s...", condition_id[:16])
+        log.error("REDEEM REVERTED %s...", condition_id[:16], extra={"condition_id": condition_id, "token_id": token_id})
         return False
     except Exception as e:
         log.error("REDEEM ERROR: %s", e)
@@ -439,280 +1514,583 @@ def redeem_position(condition_id, token_id=None):
         return _redeem_via_relayer(condition_id, token_id=token_id)
     return _redeem_direct(condition_id, token_id=token_id)
 
+# ── Resolution watcher (CTF ConditionResolution logs) ──
+# Instead of polling balanceOf / Gamma for every held position each tick, one eth_getLogs
+# call per tick (from a saved block cursor, filtered to our condition ids) picks up
+# resolutions. Held positions are only redeemed and booked once their condition shows up.
+# If log scanning keeps failing, or a position is long overdue, manage() polls as before.
+
+resolution = {"block": None, "payouts": {}, "polled_at": 0.0, "checked": {}}
+
+def load_resolution():
+    saved = load_json(RESOLUTION_FILE, {})
+    resolution["block"] = saved.get("block")
+    resolution["payouts"] = saved.get("payouts", {})
+
+def save_resolution():
+    live = {(p.condition_id or "").lower() for p in positions}
+    resolution["payouts"] = {c: v for c, v in resolution["payouts"].items() if c in live}
+    save_json(RESOLUTION_FILE, {"block": resolution["block"], "payouts": resolution["payouts"]})
+
+def decode_payouts(data):
+    """payoutNumerators from ConditionResolution data: (uint outcomeSlotCount, uint[] payoutNumerators)."""
+    raw = data[2:] if data.startswith("0x") else data
+    words = [int(raw[i:i + 64], 16) for i in range(0, len(raw), 64)]
+    start = words[1] // 32
+    return words[start + 1:start + 1 + words[start]]
+
+def payout_winner(payouts):
+    """The outcome that pays out in full, or None for a split resolution."""
+    paying = [i for i, n in enumerate(payouts) if n > 0]
+    return OUTCOMES[paying[0]] if len(paying) == 1 and paying[0] < len(OUTCOMES) else None
+
+def poll_resolutions():
+    """Scan new blocks for ConditionResolution logs of the conditions we hold."""
+    try:
+        head = int(rpc_call("eth_blockNumber"), 16) - RESOLUTION_CONFIRMATIONS
+        cids = sorted({p.condition_id.lower() for p in positions
+                       if p.status == "held" and p.condition_id and p.condition_id.lower() not in resolution["payouts"]})
+        cursor = resolution["block"] if resolution["block"] is not None else head - RESOLUTION_LOOKBACK
+        if not cids:
+            cursor = head
+        for _ in range(RESOLUTION_MAX_SPANS):
+            if cursor >= head or stage_expired():
+                break
+            to = min(head, cursor + RESOLUTION_SPAN)
+            logs = rpc_call("eth_getLogs", {"fromBlock": hex(cursor + 1), "toBlock": hex(to), "address": CTF_ADDRESS,
+                                            "topics": [CONDITION_RESOLUTION_TOPIC, cids]})
+            for entry in logs:
+                cid = entry["topics"][1].lower()
+                payouts = decode_payouts(entry["data"])
+                resolution["payouts"][cid] = payouts
+                log.info("RESOLVED on-chain %s... payouts %s (block %d)", cid[:16], payouts, int(entry["blockNumber"], 16),
+                         extra={"condition_id": cid})
+            cursor = to
+    except Exception as e:
+        log.warning("Resolution log scan failed: %s", e)
+        return
+    changed = cursor != resolution["block"]
+    resolution["block"], resolution["polled_at"] = cursor, time.time()
+    if changed:
+        save_resolution()
+
+def watcher_ok():
+    return resolution["block"] is not None and time.time() - resolution["polled_at"] < RESOLUTION_STALE
+
+def resolution_due(p, claim=True):
+    """
+    Whether manage() should check a held position past its window: resolved, watcher down, or
+    long overdue. claim=True (manage) starts the RESOLUTION_RECHECK wait for the fallback poll.
+    """
+    if (p.condition_id or "").lower() in resolution["payouts"] or not watcher_ok():
+        return True
+    if server_now() < p.end_ts + RESOLUTION_FALLBACK:
+        return False
+    now = time.time()
+    if now - resolution["checked"].get(p.token_id, 0) < RESOLUTION_RECHECK:
+        return False
+    if claim:
+        resolution["checked"][p.token_id] = now
+    return True
+
+def position_winner(p):
+    """Winning outcome of a held position's market, from its resolution log when seen, else Gamma."""
+    payouts = resolution["payouts"].get((p.condition_id or "").lower())
+    if payouts is not None:
+        return payout_winner(payouts)
+    if watcher_ok() and server_now() < p.end_ts + RESOLUTION_FALLBACK:
+        return None
+    return market_winner_cached(p.market_id)
+
 # ── Order placement ──
 
-def place_bids(market):
-    asset = market["asset"].upper()
-    tick = market["tick_size"]
-    neg = market["neg_risk"]
-    size = int(BID_AMOUNT / BID_PRICE)
-    for side, token_key in [("Up", "up_token"), ("Down", "down_token")]:
-        token_id = market[token_key]
-        if any(p["token_id"] == token_id and p["status"] in ("pending", "held") for p in positions):
-            continue
-        bal = usdc_balance()
-        if bal < BID_AMOUNT:
-            log.warning("SKIP %s %s: balance $%.2f < $%.2f", asset, side, bal, BID_AMOUNT)
-            continue
-        oid = place_gtc_buy(token_id, BID_PRICE, size, tick, neg)
-        if oid:
-            positions.append({
-                "token_id": token_id, "buy_order_id": oid, "buy_price": BID_PRICE,
-                "size": size, "cost": round(BID_PRICE * size, 2), "side": side,
-                "asset": market["asset"], "title": market["title"], "slug": market["slug"],
-                "market_id": market["market_id"], "condition_id": market["condition_id"],
-                "tick_size": tick, "neg_risk": neg, "end_ts": market["end_ts"],
-                "sell_order_id": None, "sell_price": None, "status": "pending",
-                "placed_at": datetime.now(timezone.utc).isoformat(),
-            })
-            log.info("BID %s %s: %d @ $%.2f ($%.2f) [ends %d]", asset, side, size, BID_PRICE, BID_AMOUNT, market["end_ts"])
-    save_json(POSITIONS_FILE, positions)
+def place_bid(st, market, side, price, size, open_cost):
+    """Place one strategy bid unless the token is already taken, the budget or balance is short; returns its cost."""
+    token_id = market["up_token" if side == "Up" else "down_token"]
+    if any(p.token_id == token_id and p.status in ("pending", "held") for p in positions):
+        return 0
+    cost = round(price * size, 2)
+    if st.budget and open_cost + cost > st.budget:
+        log.debug("SKIP %s %s %s: budget $%.2f reached", st.name, market["asset"].upper(), side, st.budget)
+        return 0
+    if cache["bal"] < cost:
+        log.warning("SKIP %s %s: balance $%.2f < $%.2f", market["asset"].upper(), side, cache["bal"], cost,
+                    extra={"token_id": token_id, "strategy": st.name, "asset": market["asset"], "side": side})
+        return 0
+    oid = place_gtc_buy(token_id, price, size, market["tick_size"], market["neg_risk"])
+    if not oid:
+        st.metrics["errors"] += 1
+        return 0
+    positions.append(Position(
+        token_id=token_id, buy_order_id=oid, buy_price=price,
+        size=size, cost=cost, side=side,
+        asset=market["asset"], title=market["title"], slug=market["slug"],
+        market_id=market["market_id"], condition_id=market["condition_id"],
+        tick_size=market["tick_size"], neg_risk=market["neg_risk"], end_ts=market["end_ts"], status="pending",
+        placed_at=datetime.now(timezone.utc).isoformat(), strategy=st.name,
+    ))
+    cache["bal"] = round(cache["bal"] - cost, 2)
+    st.metrics["bids"] += 1
+    log.info("BID %s %s: %d @ $%.2f ($%.2f) [ends %d] %s", market["asset"].upper(), side, size, price, cost,
+             market["end_ts"], st.name, extra=pos_fields(positions[-1]))
+    export_trade_event("bids", positions[-1])
+    if metrics["time_to_first_bid_s"] is None:
+        metrics["time_to_first_bid_s"] = round(time.time() - metrics["started_at"], 2)
+        log.info("Time to first bid: %.2fs", metrics["time_to_first_bid_s"])
+    return cost
+
+def run_strategies(markets):
+    """Give every strategy the same market view and place the bids each one asks for."""
+    view = MarketView(markets, cache["bal"], server_now())
+    open_cost = {}
+    for p in positions:
+        if p.strategy and p.status in ("pending", "held"):
+            open_cost[p.strategy] = open_cost.get(p.strategy, 0) + (p.cost or 0)
+    for st in strategies.values():
+        t0 = time.perf_counter()
+        spent = open_cost.get(st.name, 0)
+        try:
+            for market, side, price, size in st.decide(view):
+                spent += place_bid(st, market, side, price, size, spent)
+        except Exception as e:
+            st.metrics["errors"] += 1
+            log.error("Strategy %s failed: %s", st.name, e)
+        st.metrics["open_cost"] = round(spent, 2)
+        st.metrics["cycle_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    save_positions()
+
+# ── Strategies ──
+# Strategies share one per-cycle MarketView: the discovered markets, a book feed fetched
+# once (lazily, in one batch) for all of them, and the USDC balance snapshot. Each returns
+# the bids it wants and the engine places them. Positions are tagged with the strategy
+# name, which keys its budget (max open cost) and metrics. Positions are still one per
+# token, whichever strategy asked first.
+
+class MarketView:
+    def __init__(self, markets, bal, now):
+        self.markets, self.bal, self.now = markets, bal, now
+        self._books = None
+
+    def book(self, token_id):
+        """Best bid/ask; the first call fetches every discovered token's book in one request."""
+        if self._books is None:
+            self._books = get_books(t for m in self.markets for t in (m["up_token"], m["down_token"]))
+        return self._books.get(token_id, {"best_bid": 0, "best_ask": 0})
+
+class Strategy:
+    """Base class: decide(view) returns the bids to place this cycle as [(market, side, price, size)]."""
+
+    def __init__(self, name, assets=None, budget=0):
+        self.name = sys.intern(name)
+        self.assets = tuple(assets or ASSETS)
+        self.budget = float(budget)  # max open cost (pending + held) in USDC; 0 = unlimited
+        self.metrics = {"bids": 0, "fills": 0, "closed": 0, "wins": 0, "pnl": 0.0,
+                        "open_cost": 0.0, "cycle_ms": 0.0, "errors": 0}
+
+    def decide(self, view):
+        raise NotImplementedError
+
+    def describe(self):
+        return "%s [%s]" % (self.name, "+".join(self.assets))
+
+class BothSides(Strategy):
+    """Fixed-price GTC buys on both Up and Down of every market with enough time left (the original bot)."""
+
+    def __init__(self, name, price=BID_PRICE, amount=BID_AMOUNT, min_time_left=MIN_TIME_LEFT, **kwargs):
+        super().__init__(name, **kwargs)
+        self.price, self.amount, self.min_time_left = float(price), float(amount), int(min_time_left)
+        self.size = int(self.amount / self.price)
+
+    def decide(self, view):
+        return [(m, side, self.price, self.size) for m in view.markets
+                if m["asset"] in self.assets and m["time_left"] >= self.min_time_left for side in ("Up", "Down")]
+
+    def describe(self):
+        return "%s $%.0f @ $%.2f [%s]" % (self.name, self.amount, self.price, "+".join(self.assets))
+
+STRATEGY_TYPES = {"both_sides": BothSides}
+strategies = {}
+discovery_assets = list(ASSETS)
+
+def load_strategies():
+    """Build strategies from SCALP_STRATEGIES (e.g. [{"name": "scalp", "type": "both_sides", "price": 0.25}])."""
+    global discovery_assets
+    conf = json.loads(STRATEGIES_CONFIG) if STRATEGIES_CONFIG else [{"name": "scalp", "type": "both_sides"}]
+    strategies.clear()
+    for c in conf:
+        c = dict(c)
+        st = STRATEGY_TYPES[c.pop("type", "both_sides")](**c)
+        strategies[st.name] = st
+    discovery_assets = sorted({a for st in strategies.values() for a in st.assets})
+
+def strategy_tally(p, **counts):
+    st = strategies.get(p.strategy)
+    if st:
+        for k, v in counts.items():
+            st.metrics[k] = round(st.metrics[k] + v, 4)
 
 def cancel_stale_bids():
-    now = int(time.time())
-    changed = False
-    for p in list(positions):
-        if p["status"] == "pending" and now > p["end_ts"] - 30:
-            check_and_close_position(p, "expired")
-            changed = True
-    if changed:
-        positions[:] = [p for p in positions if p["status"] != "done"]
-        save_json(POSITIONS_FILE, positions); save_json(CLOSED_FILE, closed[-500:])
+    now = int(server_now())
+    stale = [p for p in positions if p.status == "pending" and now > p.end_ts - 30]
+    if stale:
+        check_and_close_positions(stale, "expired")
+        positions[:] = [p for p in positions if p.status != "done"]
+        save_positions(); save_closed()
 
 def manage():
-    now = int(time.time())
+    now = int(server_now())
     changed = False
     redeemed_cids = set()
     for p in list(positions):
-        if p["status"] == "done":
+        if stage_expired():
+            log.warning("manage: stage deadline reached, remaining positions wait for the next tick")
+            break
+        if p.status == "done":
             continue
 
-        if p["status"] == "pending":
-            actual = token_balance(p["token_id"])
+        if p.status == "pending":
+            st = order_status(p)
+            if st == "LIVE" and not orders["matched"].get(p.buy_order_id):
+                continue
+            actual = token_balance(p.token_id)
             if actual > 0:
-                p["size"] = actual
-                p["status"] = "held"
-                log.info("FILLED %s %s: %d @ $%.2f", p["asset"].upper(), p["side"], actual, p["buy_price"])
+                mark_filled(p, actual)
+                log.info("FILLED %s %s: %d @ $%.2f", p.asset.upper(), p.side, actual, p.buy_price, extra=pos_fields(p))
                 changed = True
                 continue
-            st = order_status(p["buy_order_id"])
             if st == "FILLED":
-                actual2 = token_balance_onchain(p["token_id"])
+                actual2 = token_balance_onchain(p.token_id)
                 if actual2 > 0:
-                    p["size"] = actual2
-                    p["status"] = "held"
-                    log.info("FILLED %s %s: %d @ $%.2f (on-chain)", p["asset"].upper(), p["side"], actual2, p["buy_price"])
+                    mark_filled(p, actual2)
+                    log.info("FILLED %s %s: %d @ $%.2f (on-chain)", p.asset.upper(), p.side, actual2, p.buy_price, extra=pos_fields(p))
                     changed = True
                 else:
-                    p["status"] = "held"
-                    p["size"] = int(p.get("cost", BID_AMOUNT) / p.get("buy_price", BID_PRICE))
-                    log.info("FILLED %s %s (CLOB=filled, keeping held)", p["asset"].upper(), p["side"])
+                    mark_filled(p, int(p.cost / p.buy_price))
+                    log.info("FILLED %s %s (CLOB=filled, keeping held)", p.asset.upper(), p.side, extra=pos_fields(p))
                     changed = True
             elif st == "CANCELLED":
-                actual3 = token_balance_onchain(p["token_id"])
+                actual3 = token_balance_onchain(p.token_id)
                 if actual3 > 0:
-                    p["size"] = actual3
-                    p["status"] = "held"
-                    log.info("CANCEL-BUT-FILLED %s %s: %d on-chain", p["asset"].upper(), p["side"], actual3)
+                    mark_filled(p, actual3)
+                    log.info("CANCEL-BUT-FILLED %s %s: %d on-chain", p.asset.upper(), p.side, actual3, extra=pos_fields(p))
                     changed = True
                 elif actual3 == -1:
-                    log.warning("CANCEL check RPC fail %s %s, keeping", p["asset"].upper(), p["side"])
+                    log.warning("CANCEL check RPC fail %s %s, keeping", p.asset.upper(), p.side, extra=pos_fields(p))
                 else:
-                    p["status"] = "done"
-                    p["exit_type"] = "cancelled"
-                    p["pnl"] = 0
-                    p["exit_price"] = 0
-                    p["closed_at"] = datetime.now(timezone.utc).isoformat()
-                    closed.append(p)
-                    log.info("CANCELLED %s %s (confirmed 0 on-chain)", p["asset"].upper(), p["side"])
+                    p.status = "done"
+                    p.exit_type = "cancelled"
+                    p.pnl = 0
+                    p.exit_price = 0
+                    p.closed_at = datetime.now(timezone.utc).isoformat()
+                    record_closed(p)
+                    log.info("CANCELLED %s %s (confirmed 0 on-chain)", p.asset.upper(), p.side, extra=pos_fields(p))
                     changed = True
 
-        if p["status"] == "held" and now > p["end_ts"] + 60:
-            actual = token_balance_onchain(p["token_id"])
+        if p.status == "held" and now > p.end_ts + 60:
+            if not resolution_due(p):
+                continue
+            actual = token_balance_onchain(p.token_id)
             if actual == -1:
-                log.warning("RPC fail %s %s, skip cycle", p["asset"].upper(), p["side"])
+                log.warning("RPC fail %s %s, skip cycle", p.asset.upper(), p.side, extra=pos_fields(p))
                 continue
             if actual > 0:
-                cid = p.get("condition_id", "")
+                cid = p.condition_id
                 if cid and cid not in redeemed_cids:
                     redeem_position(cid)
                     redeemed_cids.add(cid)
                     time.sleep(2)
-                    actual = token_balance_onchain(p["token_id"])
+                    actual = token_balance_onchain(p.token_id)
                     if actual is None or actual > 0:
-                        log.info("REDEEM sent, tokens remain %s %s (%s), retry next cycle", p["asset"].upper(), p["side"], actual)
+                        log.info("REDEEM sent, tokens remain %s %s (%s), retry next cycle", p.asset.upper(), p.side, actual, extra=pos_fields(p))
                         continue
             if actual == 0:
-                p["status"] = "done"
-                p["closed_at"] = datetime.now(timezone.utc).isoformat()
-                winner = get_market_winner(p["market_id"])
-                if winner == p["side"]:
-                    p["exit_type"] = "won"
-                    p["exit_price"] = 1.0
-                    p["pnl"] = round(p["size"] * 1.0 - p["cost"], 2)
+                p.status = "done"
+                p.closed_at = datetime.now(timezone.utc).isoformat()
+                winner = position_winner(p)
+                if winner == p.side:
+                    p.exit_type = "won"
+                    p.exit_price = 1.0
+                    p.pnl = round(p.size * 1.0 - p.cost, 2)
                 elif winner:
-                    p["exit_type"] = "lost"
-                    p["exit_price"] = 0.0
-                    p["pnl"] = round(-p["cost"], 2)
-                else:
-                    p["exit_type"] = "resolved"
-                    p["exit_price"] = 0
-                    p["pnl"] = round(-p["cost"], 2)
-                closed.append(p)
-                stats["pnl"] += p["pnl"]
-                if p["exit_type"] == "won":
-                    stats["wins"] += 1
+                    p.exit_type = "lost"
+                    p.exit_price = 0.0
+                    p.pnl = round(-p.cost, 2)
                 else:
-                    stats["losses"] += 1
-                log.info("RESOLVED %s %s: %s | P&L $%.2f", p["asset"].upper(), p["side"], p["exit_type"], p["pnl"])
+                    p.exit_type = "resolved"
+                    p.exit_price = 0
+                    p.pnl = round(-p.cost, 2)
+                record_closed(p)
+                log.info("RESOLVED %s %s: %s | P&L $%.2f", p.asset.upper(), p.side, p.exit_type, p.pnl, extra=pos_fields(p))
                 changed = True
     if changed:
-        positions[:] = [p for p in positions if p["status"] != "done"]
-        save_json(POSITIONS_FILE, positions); save_json(CLOSED_FILE, closed[-500:])
+        positions[:] = [p for p in positions if p.status != "done"]
+        save_positions(); save_closed()
+
+def market_winner_cached(market_id):
+    """Winner outcome, asking Gamma at most every WINNER_RECHECK per unresolved market; resolved ones are kept."""
+    winners, checked = cache["winners"], cache["winner_checked"]
+    if market_id in winners:
+        return winners[market_id]
+    now = time.time()
+    if now - checked.get(market_id, 0) < WINNER_RECHECK:
+        return None
+    checked[market_id] = now
+    winner = get_market_winner(market_id)
+    if winner:
+        winners[market_id] = winner
+    return winner
+
+def prune_winner_cache():
+    """Drop winner lookups and resolution recheck times of positions that are gone."""
+    live = {p.market_id for p in positions}
+    for d in (cache["winners"], cache["winner_checked"]):
+        for mid in [m for m in d if m not in live]:
+            del d[mid]
+    held = {p.token_id for p in positions}
+    checked = resolution["checked"]
+    for tid in [t for t in checked if t not in held]:
+        del checked[tid]
 
 def compute_trade_pnl():
-    total = stats["pnl"]
-    now = int(time.time())
+    """Realized P&L from the ledger plus the outcome of held positions whose winner is already known."""
+    total = ledger["all"]["all"]["pnl"]
+    now = int(server_now())
     for p in positions:
-        if p["status"] == "held" and now > p.get("end_ts", 0):
-            winner = get_market_winner(p.get("market_id", ""))
-            if winner == p["side"]:
-                total += round(p["size"] * 1.0 - p["cost"], 2)
+        if p.status == "held" and now > p.end_ts:
+            winner = position_winner(p)
+            if winner == p.side:
+                total += round(p.size * 1.0 - p.cost, 2)
             elif winner:
-                total += round(-p["cost"], 2)
+                total += round(-p.cost, 2)
     return round(total, 2)
 
 # ── Dashboard & API ──
 
+DASHBOARD_HTML = "/app/dashboard.html"
+_dash_page = {"mtime": None, "html": ""}
+
 @flask_app.route("/")
 def dash():
-    with open("/app/dashboard.html") as f:
-        resp = Response(f.read(), content_type="text/html")
-        resp.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
-        return resp
+    mtime = os.path.getmtime(DASHBOARD_HTML)
+    if mtime != _dash_page["mtime"]:  # re-read only after the file is swapped
+        with open(DASHBOARD_HTML) as f:
+            _dash_page.update(mtime=mtime, html=f.read())
+    resp = Response(_dash_page["html"], content_type="text/html")
+    resp.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
+    return resp
+
+@flask_app.after_request
+def compress_response(resp):
+    """gzip JSON bodies for clients that accept it."""
+    if resp.mimetype == "application/json" and not resp.direct_passthrough \
+            and "gzip" in flask_request.headers.get("Accept-Encoding", "") and "Content-Encoding" not in resp.headers:
+        body = resp.get_data()
+        if len(body) >= GZIP_MIN_BYTES:
+            resp.set_data(gzip.compress(body, 5))
+            resp.headers["Content-Encoding"] = "gzip"
+            resp.headers["Vary"] = "Accept-Encoding"
+    return resp
+
+@flask_app.errorhandler(BadRequest)
+def bad_request(e):
+    return jsonify({"err": e.description}), 400
+
+def query_arg(name, type_, default=None, minimum=None, maximum=None):
+    """Typed query parameter, or default when absent; 400 when malformed, non-finite or out of bounds."""
+    if flask_request.args.get(name, "") == "":
+        return default
+    value = flask_request.args.get(name, type=type_)
+    if (value is None or not math.isfinite(value) or (minimum is not None and value < minimum)
+            or (maximum is not None and value > maximum)):
+        raise BadRequest("Invalid %s: %r" % (name, flask_request.args[name]))
+    return value
 
 @flask_app.route("/api/status")
 def api_status():
-    pos_data = []
-    for p in positions:
-        d = dict(p)
-        d["bid"] = cache["bids"].get(p.get("token_id"))
-        pos_data.append(d)
-    trade_pnl = compute_trade_pnl()
-    open_cost = sum(p.get("cost", 0) for p in positions if p["status"] in ("held", "pending"))
-    portfolio_value = data_api_value()
-    return jsonify({
-        "bal": cache["bal"],
-        "paused": bot_paused,
-        "pos": pos_data,
-        "closed": closed[-50:],
-        "stats": {
-            "wins": stats["wins"],
-            "losses": stats["losses"],
-            "pnl": stats["pnl"],
-            "trade_pnl": trade_pnl,
-            "open_cost": open_cost,
-            "portfolio_value": portfolio_value,
-            "builder_relayer": relay_client is not None,
-        },
-        "timezone": "UTC",
-        "gas_balance": round(w3.eth.get_balance(w3_account.address) / 1e18, 6) if w3 and w3_account else 0,
-        "wallet": w3_account.address if w3_account else "",
-    })
+    """
+    Full status, or with ?since=<seq> only the fields, positions and closed trades that changed
+    after that seq plus `gone` (token ids of removed positions). `full` is true when the client
+    must drop its copy: no/unknown since, a restart, or tombstones already pruned.
+    """
+    s = current_snapshot()
+    ver = s["ver"]
+    since = flask_request.args.get("since", type=int)
+    full = since is None or since < ver["floor"] or since > s["seq"]
+    if full:
+        since = -1
+    out = {"seq": s["seq"], "full": full, "timezone": "UTC"}
+    out.update((k, s[k]) for k in STATUS_FIELDS if ver["fields"][k] > since)
+    out["pos"] = [d for d in s["pos"] if ver["pos"][d["token_id"]] > since]
+    out["gone"] = [t for t, v in ver["gone"].items() if v > since] if not full else []
+    out["closed"] = [c for c, v in zip(s["closed"], ver["closed"]) if v > since]
+    return jsonify(out)
 
-@flask_app.route("/api/pause", methods=["POST"])
-def api_pause():
-    global bot_paused
-    bot_paused = True
-    log.info("BOT PAUSED by user")
-    return jsonify({"success": True, "paused": True})
+@flask_app.route("/api/closed")
+def api_closed():
+    """Closed-trade history from disk, newest first; pass the returned cursor as ?before= for older pages."""
+    limit = min(query_arg("limit", int, 50, minimum=1), 500)
+    records, cursor = read_closed_page(query_arg("before", int, minimum=0), limit)
+    return jsonify({"closed": records, "cursor": cursor})
 
-@flask_app.route("/api/resume", methods=["POST"])
-def api_resume():
+@flask_app.route("/api/events")
+def api_events():
+    """
+    Recent structured log events, oldest first. Filters: level (minimum), token, asset, side,
+    status, q (text in msg), since (event id; returns newer events only), limit (>= 1).
+    """
+    args = flask_request.args.to_dict()
+    args["since"] = query_arg("since", int, minimum=0)
+    args["limit"] = query_arg("limit", int, 200, minimum=1)
+    out = engine_query(query_events, args)
+    if out.get("unreachable"):
+        return jsonify(out), 503
+    return jsonify(out), 400 if "err" in out else 200
+
+def query_events(args):
+    min_level = logging.getLevelName(args.get("level", "INFO").upper())
+    if not isinstance(min_level, int):
+        return {"err": "Unknown level"}
+    since = args.get("since")
+    limit = min(args.get("limit") or 200, EVENTS_KEEP)
+    match = {k: args[q] for k, q in (("token_id", "token"), ("asset", "asset"), ("side", "side"), ("status", "status"))
+             if args.get(q)}
+    text = args.get("q", "").lower()
+    out = []
+    for e in reversed(tuple(events)):
+        if since is not None and e["id"] <= since:
+            break
+        if logging.getLevelName(e["level"]) < min_level or any(e.get(k) != v for k, v in match.items()):
+            continue
+        if text and text not in e["msg"].lower():
+            continue
+        out.append(e)
+        if len(out) >= limit:
+            break
+    out.reverse()
+    return {"events": out, "last_id": events[-1]["id"] if events else None, "dropped": log_queue.dropped}
+
+@flask_app.route("/api/stats")
+def api_stats():
+    """
+    Ledger aggregates. Optional range: ?hours=N (last N hours) or ?from=<unix>&to=<unix>;
+    ranges resolve to whole UTC hours. Without a range, all-time totals.
+    """
+    s = current_snapshot()
+    view = current_ledger(s)
+    if not view:
+        return jsonify({"err": "Engine starting"}), 503
+    since, until = query_arg("from", float), query_arg("to", float)
+    hours = query_arg("hours", float, minimum=0)
+    if hours is not None:
+        since = time.time() - hours * 3600
+    out = ledger_range(view, since, until)
+    out.update(exposure=s["stats"]["open_cost"], trade_pnl=s["stats"]["trade_pnl"], seq=s["seq"])
+    return jsonify(out)
+
+@flask_app.route("/api/analytics")
+def api_analytics():
+    """Fill rate / win rate / edge / drawdown from the columnar export: ?days=90&by=asset,hour"""
+    try:
+        import analytics  # needs numpy
+    except ImportError:
+        return jsonify({"err": "Analytics unavailable (numpy not installed)"}), 501
+    by = [b for b in flask_request.args.get("by", "asset,hour").split(",") if b]
+    if any(b not in ("asset", "side", "hour") for b in by):
+        return jsonify({"err": "by must be drawn from asset, side, hour"}), 400
+    return jsonify(analytics.report(query_arg("days", float, 90, minimum=0), by, BID_PRICE, COLUMNS_DIR))
+
+# ── Engine commands (run on the engine thread via apply_commands) ──
+
+def cmd_set_paused(paused):
     global bot_paused
-    bot_paused = False
-    log.info("BOT RESUMED by user")
-    return jsonify({"success": True, "paused": False})
+    bot_paused = paused
+    log.info("BOT %s by user", "PAUSED" if paused else "RESUMED")
+    return {"success": True, "paused": paused}
 
-@flask_app.route("/api/reconcile", methods=["POST"])
-def api_reconcile():
-    """Manual trigger for Data API reconciliation."""
+def cmd_reconcile():
     cache["last_reconcile"] = 0
-    reconcile_positions()
-    return jsonify({"msg": "Reconciliation complete", "positions": len(positions)})
+    cache["recon_fp"] = {}  # full pass
+    stage("reconcile", reconcile_positions, force=True)  # own deadline, not the "commands" one
+    return {"msg": "Reconciliation complete", "positions": len(positions)}
 
-@flask_app.route("/api/sell", methods=["POST"])
-def api_sell():
-    tid = flask_request.get_json().get("token_id", "")
-    p = next((x for x in positions if x["token_id"] == tid), None)
+def cmd_cancel_bid(p):
+    if not check_and_close_position(p, "cancelled"):
+        save_positions()
+        return {"msg": "Bid was actually filled — now held"}
+    positions[:] = [x for x in positions if x.status != "done"]
+    save_positions(); save_closed()
+    return {"msg": "Bid cancelled"}
+
+def cmd_sell(tid):
+    p = next((x for x in positions if x.token_id == tid), None)
     if not p:
-        return jsonify({"err": "Not found"})
-    if p["status"] == "pending":
-        if not check_and_close_position(p, "cancelled"):
-            save_json(POSITIONS_FILE, positions)
-            return jsonify({"msg": "Bid was actually filled — now held"})
-        positions[:] = [x for x in positions if x["status"] != "done"]
-        save_json(POSITIONS_FILE, positions)
-        return jsonify({"msg": "Bid cancelled"})
+        return {"err": "Not found"}
+    if p.status == "pending":
+        return cmd_cancel_bid(p)
     actual = token_balance_onchain(tid)
     if actual < 1:
-        return jsonify({"err": "No shares on-chain"})
+        return {"err": "No shares on-chain"}
     book = get_book(tid)
     best = book["best_bid"]
     if best < 0.01:
-        return jsonify({"err": "No bids in book"})
-    oid = fak_sell(tid, best, actual, p["tick_size"], p["neg_risk"])
+        return {"err": "No bids in book"}
+    oid = fak_sell(tid, best, actual, p.tick_size, p.neg_risk)
     if oid:
-        p["status"] = "done"
-        p["exit_type"] = "manual_sell"
-        p["exit_price"] = best
-        p["pnl"] = round(best * actual - p["cost"], 2)
-        p["closed_at"] = datetime.now(timezone.utc).isoformat()
-        stats["pnl"] += p["pnl"]
-        if p["pnl"] >= 0:
-            stats["wins"] += 1
-        else:
-            stats["losses"] += 1
-        closed.append(p)
-        positions[:] = [x for x in positions if x["status"] != "done"]
-        save_json(POSITIONS_FILE, positions)
-        return jsonify({"msg": "Sold %d @ $%.2f | P&L $%.2f" % (actual, best, p["pnl"])})
-    return jsonify({"err": "Sell failed"})
+        close_position(p, "manual_sell", best, round(best * actual - p.cost, 2))
+        positions[:] = [x for x in positions if x.status != "done"]
+        save_positions(); save_closed()
+        return {"msg": "Sold %d @ $%.2f | P&L $%.2f" % (actual, best, p.pnl)}
+    return {"err": "Sell failed"}
 
-@flask_app.route("/api/cancel", methods=["POST"])
-def api_cancel():
-    tid = flask_request.get_json().get("token_id", "")
-    p = next((x for x in positions if x["token_id"] == tid), None)
+def cmd_cancel(tid):
+    p = next((x for x in positions if x.token_id == tid), None)
     if not p:
-        return jsonify({"err": "Not found"})
-    if p["status"] == "pending":
-        if not check_and_close_position(p, "cancelled"):
-            save_json(POSITIONS_FILE, positions)
-            return jsonify({"msg": "Bid was actually filled — now held"})
-        positions[:] = [x for x in positions if x["status"] != "done"]
-        save_json(POSITIONS_FILE, positions)
-        return jsonify({"msg": "Bid cancelled"})
-    return jsonify({"err": "Not a pending bid"})
+        return {"err": "Not found"}
+    if p.status == "pending":
+        return cmd_cancel_bid(p)
+    return {"err": "Not a pending bid"}
+
+@flask_app.route("/api/pause", methods=["POST"])
+def api_pause():
+    return jsonify(submit_command(cmd_set_paused, True))
+
+@flask_app.route("/api/resume", methods=["POST"])
+def api_resume():
+    return jsonify(submit_command(cmd_set_paused, False))
 
+@flask_app.route("/api/reconcile", methods=["POST"])
+def api_reconcile():
+    """Manual trigger for Data API reconciliation."""
+    return jsonify(submit_command(cmd_reconcile))
+
+@flask_app.route("/api/sell", methods=["POST"])
+def api_sell():
+    return jsonify(submit_command(cmd_sell, flask_request.get_json().get("token_id", "")))
+
+@flask_app.route("/api/cancel", methods=["POST"])
+def api_cancel():
+    return jsonify(submit_command(cmd_cancel, flask_request.get_json().get("token_id", "")))
 
 @flask_app.route("/api/withdraw", methods=["POST"])
 def api_withdraw():
-    if not w3 or not w3_account or not usdc_contract:
-        return jsonify({"success": False, "error": "Bot not initialized"})
     data = flask_request.get_json()
-    to_addr = data.get("to", "").strip()
-    amount = data.get("amount", 0)
-    if not to_addr or not Web3.is_address(to_addr):
-        return jsonify({"success": False, "error": "Invalid address"})
+    return jsonify(engine_query(withdraw, data.get("to", "").strip(), data.get("amount", 0)))
+
+def withdraw(to_addr, amount):
+    """Send USDC from the bot wallet (runs on the calling thread, not the engine's)."""
+    if not w3 or not w3_account or not usdc_contract:
+        return {"success": False, "error": "Bot not initialized"}
+    if not to_addr or not w3.is_address(to_addr):
+        return {"success": False, "error": "Invalid address"}
     if amount <= 0:
-        return jsonify({"success": False, "error": "Invalid amount"})
+        return {"success": False, "error": "Invalid amount"}
     try:
         raw_amount = int(amount * 1e6)
         bal = usdc_contract.functions.balanceOf(w3_account.address).call()
         if raw_amount > bal:
-            return jsonify({"success": False, "error": f"Insufficient balance: ${bal/1e6:.2f}"})
+            return {"success": False, "error": f"Insufficient balance: ${bal/1e6:.2f}"}
         tx = usdc_contract.functions.transfer(
-            Web3.to_checksum_address(to_addr), raw_amount
+            w3.to_checksum_address(to_addr), raw_amount
         ).build_transaction({
             "from": w3_account.address,
             "nonce": w3.eth.get_transaction_count(w3_account.address),
@@ -724,15 +2102,15 @@ def api_withdraw():
         receipt = w3.eth.wait_for_transaction_receipt(tx_hash, timeout=60)
         if receipt.status == 1:
             log.info("Withdraw $%.2f USDC to %s TX: %s", amount, to_addr, tx_hash.hex())
-            return jsonify({"success": True, "tx_hash": tx_hash.hex()})
-        return jsonify({"success": False, "error": "Transaction reverted"})
+            return {"success": True, "tx_hash": tx_hash.hex()}
+        return {"success": False, "error": "Transaction reverted"}
     except Exception as e:
-        return jsonify({"success": False, "error": str(e)})
+        return {"success": False, "error": str(e)}
 
 # ── Builder relayer init ──
 
-def init_builder_relayer():
-    """Initialize Builder relayer for gasless transactions (optional)."""
+def init_builder_relayer(read_only=False):
+    """Initialize Builder relayer for gasless transactions (optional); read_only never deploys the Safe."""
     global relay_client
     if not (BUILDER_KEY and BUILDER_SECRET and BUILDER_PASSPHRASE):
         log.info("Builder relayer: disabled (no POLY_BUILDER_* env vars)")
@@ -749,29 +2127,68 @@ def init_builder_relayer():
         relay_client = RelayClient(
             "https://relayer-v2.polymarket.com", 137, PRIVATE_KEY, builder_config
         )
-        # Deploy Safe wallet if not yet deployed
+        # Deploy Safe wallet if not yet deployed (a confirmed deployment is cached across restarts)
         safe_addr = relay_client.get_expected_safe()
-        if not relay_client.get_deployed(safe_addr):
+        if init_cache.get("safe_deployed") == safe_addr:
+            log.info("Safe wallet already deployed: %s (cached)", safe_addr)
+        elif read_only:
+            log.info("Safe wallet %s: deployment not checked (read-only)", safe_addr)
+        elif not relay_client.get_deployed(safe_addr):
             log.info("Deploying Safe wallet %s via relayer...", safe_addr)
             resp = relay_client.deploy()
             resp.wait()
             log.info("Safe wallet deployed: %s", safe_addr)
         else:
             log.info("Safe wallet already deployed: %s", safe_addr)
+            save_init_cache(safe_deployed=safe_addr)
         log.info("Builder relayer: ENABLED (gasless redemptions)")
     except ImportError as e:
         log.warning("Builder relayer: import error — %s, using direct tx", e)
     except Exception as e:
         log.warning("Builder relayer init failed: %s — using direct tx", e)
 
-# ── Main loop ──
+# ── Startup ──
 
-def run():
-    global clob, w3, w3_account, ctf_contract, neg_risk_adapter, usdc_contract, positions, closed
-    log.info("Scalper v9 | $%.0f @ $%.2f | %s | Data API + Builder relayer", BID_AMOUNT, BID_PRICE, "+".join(ASSETS))
+def _init_cache_key():
+    return hashlib.sha256((PRIVATE_KEY or "").encode()).hexdigest()[:16]
+
+def load_init_cache():
+    cached = load_json(INIT_CACHE_FILE, {})
+    init_cache.clear()
+    if cached.get("key") == _init_cache_key():
+        init_cache.update(cached)
+
+def save_init_cache(**updates):
+    with _init_cache_lock:
+        init_cache.update(updates, key=_init_cache_key())
+        os.makedirs(DATA_DIR, exist_ok=True)
+        fd = os.open(INIT_CACHE_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f: json.dump(init_cache, f, indent=2)
+
+def init_clob():
+    """CLOB client using cached API creds; derives (and caches) new ones only on a miss or rejection."""
+    global clob
+    from py_clob_client.client import ClobClient
+    from py_clob_client.clob_types import ApiCreds
+    from py_clob_client.constants import POLYGON
+    install_http_routing()
     clob = ClobClient(CLOB_HOST, key=PRIVATE_KEY, chain_id=POLYGON)
+    cached = init_cache.get("api_creds")
+    if cached:
+        clob.set_api_creds(ApiCreds(**cached))
+        try:
+            return collateral_balance()
+        except Exception as e:
+            log.info("Cached API creds rejected (%s) — deriving", e)
     creds = clob.create_or_derive_api_creds()
     clob.set_api_creds(creds)
+    save_init_cache(api_creds={"api_key": creds.api_key, "api_secret": creds.api_secret,
+                               "api_passphrase": creds.api_passphrase})
+    return usdc_balance()
+
+def init_web3(read_only=False):
+    global w3, w3_account, ctf_contract, neg_risk_adapter, usdc_contract
+    from web3 import Web3
     w3 = Web3(Web3.HTTPProvider(RPC_URL))
     w3_account = w3.eth.account.from_key(PRIVATE_KEY)
     ctf_contract = w3.eth.contract(address=Web3.to_checksum_address(CTF_ADDRESS), abi=CTF_ABI)
@@ -780,10 +2197,14 @@ def run():
         address=Web3.to_checksum_address(NEG_RISK_ADAPTER),
         abi=[{"inputs": [{"name": "_conditionId", "type": "bytes32"}, {"name": "_amounts", "type": "uint256[]"}],
               "name": "redeemPositions", "outputs": [], "stateMutability": "nonpayable", "type": "function"}])
-    # Ensure CTF approval for NegRiskAdapter
+    # Ensure CTF approval for NegRiskAdapter (skipped once an approval has been seen)
+    if read_only or init_cache.get("ctf_approved"):
+        return
     try:
         _approved = ctf_contract.functions.isApprovedForAll(w3_account.address, NEG_RISK_ADAPTER).call()
-        if not _approved:
+        if _approved:
+            save_init_cache(ctf_approved=True)
+        else:
             log.info("Setting CTF approval for NegRiskAdapter...")
             _n = w3.eth.get_transaction_count(w3_account.address)
             _atx = ctf_contract.functions.setApprovalForAll(NEG_RISK_ADAPTER, True).build_transaction({
@@ -795,51 +2216,303 @@ def run():
             log.info("CTF approved for NegRiskAdapter")
     except Exception as e:
         log.warning("Approval check failed: %s", e)
-    init_builder_relayer()
-    log.info("CLOB+Web3 ready | USDC: $%.2f | wallet: %s", usdc_balance(), w3_account.address)
-    positions = load_json(POSITIONS_FILE, [])
-    closed = load_json(CLOSED_FILE, [])
+
+def init_clients(read_only=False):
+    """
+    Bring up CLOB, web3 and relayer concurrently (each also pays for its own imports); returns USDC balance.
+    read_only skips everything that sends a transaction: the CTF approval and the Safe deployment.
+    """
+    load_init_cache()
+    with ThreadPoolExecutor(max_workers=3, thread_name_prefix="init") as pool:
+        bal = pool.submit(init_clob)
+        web3_ready = pool.submit(init_web3, read_only)
+        relayer_ready = pool.submit(init_builder_relayer, read_only)
+        web3_ready.result(); relayer_ready.result()
+        return bal.result()
+
+# ── Tick watchdog ──
+# Each tick runs as named stages with a deadline apiece. A watchdog thread logs the engine
+# thread's stack once when a stage runs past its deadline and counts the overrun then, so a
+# hung stage shows up before it returns; long stages (manage, reconcile) also check
+# stage_expired() and stop early. A stage can run inside another (a reconcile command inside
+# "commands") under its own deadline; its time is not charged to the outer stage. Once a stage
+# overruns or the tick passes TICK_BUDGET, the remaining non-critical stages are skipped for
+# that tick so discovery and bidding still happen on time. Per-stage timings are in metrics["stages"].
+
+TICK_BUDGET = float(os.getenv("SCALP_TICK_BUDGET", "45"))  # seconds before non-critical stages are skipped
+WATCHDOG_INTERVAL = 1.0
+# stage -> (deadline in seconds, critical)
+STAGES = {
+    "commands": (5, True), "clock": (5, True), "balance": (10, True), "books": (10, True),
+    "orders": (15, True), "cancel": (15, True), "resolution": (10, False), "manage": (30, False), "reconcile": (20, False),
+    "discover": (20, True), "pnl": (10, False), "bid": (30, True), "values": (15, False),
+}
+stage_stats = {name: {"last_ms": 0.0, "max_ms": 0.0, "overruns": 0, "skipped": 0} for name in STAGES}
+tick = {"started": 0.0, "overrun": False, "current": None,  # current = (stage, started, deadline)
+        "nested": 0.0, "stalled": None}  # nested: seconds spent in inner stages; stalled: (stage, started) already counted
+
+def tick_start():
+    tick.update(started=time.monotonic(), overrun=False, current=None)
+
+def stage_expired():
+    cur = tick["current"]
+    return cur is not None and time.monotonic() > cur[2]
+
+def stage(name, fn, *args, force=False):
+    """
+    Run one tick stage under its deadline; non-critical stages are skipped when the tick is
+    already late unless `force` (operator commands).
+    """
+    limit, critical = STAGES[name]
+    stats = stage_stats[name]
+    t0 = time.monotonic()
+    if not critical and not force and (tick["overrun"] or t0 - tick["started"] > TICK_BUDGET):
+        stats["skipped"] += 1
+        log.warning("SKIP stage %s: tick %.0fs in%s", name, t0 - tick["started"], ", after an overrun" if tick["overrun"] else "")
+        return None
+    outer, nested = tick["current"], tick["nested"]
+    tick["current"] = (name, t0, t0 + limit)
+    try:
+        return fn(*args)
+    finally:
+        total = time.monotonic() - t0
+        elapsed = total - (tick["nested"] - nested)
+        if outer:  # give the outer stage its deadline back
+            tick["current"] = (outer[0], outer[1], outer[2] + total)
+            tick["nested"] = nested + total
+        else:
+            tick["current"] = None
+        stats["last_ms"] = round(elapsed * 1000, 1)
+        stats["max_ms"] = max(stats["max_ms"], stats["last_ms"])
+        if elapsed > limit:
+            if tick["stalled"] != (name, t0):  # not already counted by the watchdog
+                stats["overruns"] += 1
+                tick["overrun"] = True
+            log.warning("Stage %s took %.1fs (deadline %ds)", name, elapsed, limit)
+
+def tick_end():
+    elapsed = time.monotonic() - tick["started"]
+    metrics["tick_ms"] = round(elapsed * 1000, 1)
+    if elapsed > TICK_BUDGET:
+        metrics["tick_overruns"] += 1
+        log.warning("Tick took %.1fs (budget %.0fs)", elapsed, TICK_BUDGET)
+
+def watchdog_loop(engine_ident):
+    reported = None
+    while True:
+        time.sleep(WATCHDOG_INTERVAL)
+        cur = tick["current"]
+        if cur is None or cur == reported or time.monotonic() <= cur[2]:
+            continue
+        reported = cur
+        if tick["stalled"] != cur[:2]:
+            tick["stalled"] = cur[:2]
+            stage_stats[cur[0]]["overruns"] += 1
+            tick["overrun"] = True
+        frame = sys._current_frames().get(engine_ident)
+        stack = "".join(traceback.format_stack(frame)) if frame else "(engine thread not found)\n"
+        log.warning("STALL stage %s running %.0fs (deadline %ds), engine stack:\n%s",
+                    cur[0], time.monotonic() - cur[1], STAGES[cur[0]][0], stack.rstrip())
+
+def start_watchdog():
+    threading.Thread(target=watchdog_loop, args=(engine_ident,), name="watchdog", daemon=True).start()
+
+# ── Profiler ──
+# A side thread samples the engine thread's stack (sys._current_frames) and folds the
+# samples into collapsed stacks, one "frame;frame;... count" line per distinct stack, which
+# flamegraph.pl and speedscope read as-is. The root frame is the tick stage that was running
+# ("stage:manage", "stage:-" between stages and while sleeping). On demand via
+# /debug/profile (X-Debug-Token header = SCALP_DEBUG_TOKEN), or continuously with SCALP_PROFILE_HZ > 0.
+# Profiles are saved to DATA_DIR/profiles; the newest PROFILE_KEEP are kept.
+
+PROFILE_DIR = os.path.join(DATA_DIR, "profiles")
+PROFILE_KEEP = 50
+PROFILE_MAX_SECONDS = 60  # on-demand limit (stays under the command socket timeout)
+PROFILE_CONTINUOUS_HZ = float(os.getenv("SCALP_PROFILE_HZ", "0"))  # > 0: always sample at this rate
+PROFILE_WINDOW = 600  # seconds per continuous profile file
+DEBUG_TOKEN = os.getenv("SCALP_DEBUG_TOKEN", "")  # empty = /debug routes disabled
+engine_ident = None
+_profile_lock = threading.Lock()
+
+def _fold(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append("%s (%s)" % (code.co_name, os.path.basename(code.co_filename)))
+        frame = frame.f_back
+    cur = tick["current"]
+    names.append("stage:%s" % (cur[0] if cur else "-"))
+    return ";".join(reversed(names))
+
+def sample_stacks(seconds, hz):
+    counts = Counter()
+    interval, end = 1.0 / hz, time.monotonic() + seconds
+    while time.monotonic() < end:
+        frame = sys._current_frames().get(engine_ident)
+        if frame is not None:
+            counts[_fold(frame)] += 1
+        del frame
+        time.sleep(interval)
+    return counts
+
+def save_profile(counts, kind):
+    """Write collapsed stacks to PROFILE_DIR and drop the oldest files past PROFILE_KEEP; returns (name, text)."""
+    text = "".join("%s %d\n" % (stack, n) for stack, n in counts.most_common())
+    name = "%s_%s.folded" % (datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ"), kind)
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    with open(os.path.join(PROFILE_DIR, name), "w") as f:
+        f.write(text)
+    files = sorted(f for f in os.listdir(PROFILE_DIR) if f.endswith(".folded"))
+    for old in files[:-PROFILE_KEEP]:
+        os.remove(os.path.join(PROFILE_DIR, old))
+    return name, text
+
+def profile(seconds=10, hz=100):
+    """Sample the engine thread for `seconds` and save the profile (runs off the engine thread)."""
+    if engine_ident is None:
+        return {"err": "Engine not running"}
+    if not _profile_lock.acquire(blocking=False):
+        return {"err": "A profile is already running"}
+    try:
+        counts = sample_stacks(min(float(seconds), PROFILE_MAX_SECONDS), min(max(float(hz), 1), 1000))
+    finally:
+        _profile_lock.release()
+    if not counts:
+        return {"err": "No samples taken"}
+    name, text = save_profile(counts, "ondemand")
+    log.info("Profile %s: %d samples, %d stacks", name, sum(counts.values()), len(counts))
+    return {"name": name, "samples": sum(counts.values()), "folded": text}
+
+def continuous_profiler():
+    while True:
+        counts = sample_stacks(PROFILE_WINDOW, PROFILE_CONTINUOUS_HZ)
+        if counts:
+            save_profile(counts, "continuous")
+
+def start_profiler():
+    if PROFILE_CONTINUOUS_HZ > 0:
+        threading.Thread(target=continuous_profiler, name="profiler", daemon=True).start()
+        log.info("Continuous profiling at %g Hz into %s", PROFILE_CONTINUOUS_HZ, PROFILE_DIR)
+
+def _debug_authorized():
+    given = flask_request.headers.get("X-Debug-Token", "")
+    return bool(DEBUG_TOKEN) and hmac.compare_digest(given.encode(), DEBUG_TOKEN.encode())
+
+@flask_app.route("/debug/profile")
+def debug_profile():
+    """Profile the trading loop for ?seconds=10 (1..PROFILE_MAX_SECONDS) at ?hz=100 (1..1000); returns collapsed stacks."""
+    if not _debug_authorized():
+        return jsonify({"err": "Forbidden"}), 403
+    seconds = query_arg("seconds", float, 10, minimum=1, maximum=PROFILE_MAX_SECONDS)
+    hz = query_arg("hz", float, 100, minimum=1, maximum=1000)
+    out = engine_query(profile, seconds, hz)
+    if "err" in out:
+        return jsonify(out), 409
+    resp = Response(out["folded"], content_type="text/plain")
+    resp.headers["Content-Disposition"] = "attachment; filename=%s" % out["name"]
+    resp.headers["X-Profile-Samples"] = str(out["samples"])
+    return resp
+
+@flask_app.route("/debug/profiles")
+@flask_app.route("/debug/profiles/<name>")
+def debug_profiles(name=None):
+    """Saved profiles, newest first, or one of them by name."""
+    if not _debug_authorized():
+        return jsonify({"err": "Forbidden"}), 403
+    try:
+        files = sorted((f for f in os.listdir(PROFILE_DIR) if f.endswith(".folded")), reverse=True)
+    except FileNotFoundError:
+        files = []
+    if name is None:
+        return jsonify({"profiles": [{"name": f, "bytes": os.path.getsize(os.path.join(PROFILE_DIR, f))} for f in files]})
+    if name not in files:
+        return jsonify({"err": "Not found"}), 404
+    with open(os.path.join(PROFILE_DIR, name)) as f:
+        return Response(f.read(), content_type="text/plain")
+
+# ── Main loop ──
+
+def run():
+    global positions, closed, engine_ident
+    engine_ident = threading.get_ident()
+    load_strategies()
+    log.info("Scalper v9 | %s | Data API + Builder relayer", " | ".join(st.describe() for st in strategies.values()))
+    bal = init_clients()
+    metrics["startup_s"] = round(time.time() - metrics["started_at"], 2)
+    log.info("CLOB+Web3 ready in %.2fs | USDC: $%.2f | wallet: %s", metrics["startup_s"], bal, w3_account.address)
+    start_book_recorder()
+    start_watchdog()
+    start_profiler()
+    positions = [Position.from_dict(d) for d in load_json(POSITIONS_FILE, [])]
+    for p in positions:
+        if p.strategy is None and p.source is None:  # bids placed before strategies were tagged
+            p.strategy = next(iter(strategies))
+    closed = deque((Position.from_dict(d) for d in load_json(CLOSED_FILE, [])), maxlen=CLOSED_WINDOW)
+    if closed and not os.path.exists(CLOSED_HISTORY_FILE):
+        with open(CLOSED_HISTORY_FILE, "w") as f:
+            f.writelines(json.dumps(c.to_dict()) + "\n" for c in closed)
     log.info("Restored %d pos, %d closed", len(positions), len(closed))
-    for c in closed:
-        if c.get("exit_type") == "won":
-            stats["wins"] += 1
-        elif c.get("exit_type") == "lost":
-            stats["losses"] += 1
-        stats["pnl"] += c.get("pnl", 0)
-    log.info("Stats: %d W / %d L | trade P&L $%+.2f", stats["wins"], stats["losses"], stats["pnl"])
+    load_ledger()
+    load_resolution()
+    start_trade_export()
+    backfill_trade_export()
+    totals = ledger["all"]["all"]
+    log.info("Stats: %d W / %d L | trade P&L $%+.2f", totals["wins"], totals["losses"], totals["pnl"])
 
-    reconcile_positions()
-    log.info("Initial reconciliation done — portfolio value: $%.2f", data_api_value())
+    publish_snapshot()
 
+    first_tick = True  # first tick bids before reconciling so a restart gets orders out quickly
     while True:
+        markets = []
+        tick_start()
         try:
-            bal = usdc_balance()
+            stage("commands", apply_commands)
+            stage("clock", sync_clock)
+            bal = stage("balance", usdc_balance)
             cache["bal"] = bal
-            for p in positions:
-                try:
-                    cache["bids"][p["token_id"]] = get_book(p["token_id"])["best_bid"]
-                except Exception:
-                    pass
-            cancel_stale_bids()
-            manage()
-            reconcile_positions()
-            markets = find_current_markets()
-            now_ts = int(time.time())
+            cache["bids"] = stage("books", lambda: {t: b["best_bid"] for t, b in get_books(p.token_id for p in positions).items()})
+            stage("orders", sync_orders)
+            stage("cancel", cancel_stale_bids)
+            stage("resolution", poll_resolutions)
+            stage("manage", manage)
+            if not first_tick:
+                stage("reconcile", reconcile_positions)
+            markets = stage("discover", find_current_markets)
+            set_book_tokens(markets)
+            now_ts = int(server_now())
             tl = ((now_ts // 900) * 900 + 900) - now_ts
-            pnl = compute_trade_pnl()
+            prune_winner_cache()
+            pnl = stage("pnl", compute_trade_pnl)
+            if pnl is not None:
+                cache["trade_pnl"] = pnl
+            totals = ledger["all"]["all"]
             paused_tag = " PAUSED" if bot_paused else ""
             log.info("-- tick -- %d pos | $%.2f | %d mkts | P&L $%+.2f | %dW/%dL | window %dm%ds%s --",
-                     len(positions), bal, len(markets), pnl, stats["wins"], stats["losses"], tl // 60, tl % 60, paused_tag)
+                     len(positions), bal, len(markets), cache["trade_pnl"], totals["wins"], totals["losses"], tl // 60, tl % 60, paused_tag)
             if not bot_paused:
-                for mkt in markets:
-                    place_bids(mkt)
+                stage("bid", run_strategies, markets)
             else:
                 log.info("Paused — skipping bid placement")
+            if first_tick:
+                first_tick = False
+                stage("reconcile", reconcile_positions)
+            stage("values", refresh_account_values)
         except Exception as e:
             log.error("Loop error: %s", e)
-        time.sleep(POLL_SECONDS)
+        tick_end()
+        save_ledger()
+        publish_snapshot()
+        delay, why = next_wake(markets)
+        log.debug("Next wake in %.1fs (%s)", delay, why)
+        apply_commands(delay)
 
 if __name__ == "__main__":
     os.makedirs(DATA_DIR, exist_ok=True)
-    threading.Thread(target=lambda: flask_app.run(host="0.0.0.0", port=PORT, debug=False), daemon=True).start()
+    if "--dashboard" in sys.argv:  # worker: python scalper.py --dashboard [--fd N]
+        serve_dashboard(int(sys.argv[sys.argv.index("--fd") + 1]) if "--fd" in sys.argv else None)
+        sys.exit(0)
+    if DASHBOARD_MODE == "process":
+        start_dashboard_workers()
+    else:
+        threading.Thread(target=lambda: flask_app.run(host="0.0.0.0", port=PORT, debug=False), daemon=True).start()
     run()
@@ -0,0 +1,249 @@
+"""
+Bulk operator CLI — cancel, sell or redeem every tracked position at once, on scalper.py's clients.
+
+Balances come from one CTF balanceOfBatch call and books from one get_order_books call; sells are
+posted concurrently and booked like engine exits (history, ledger, columnar export). Redemptions,
+one per condition covering every held outcome, go out as one Builder relayer batch, or as direct
+transactions sent back-to-back with locally assigned nonces and then awaited together.
+
+python scripts/bulk.py cancel [--dry-run]
+python scripts/bulk.py sell   [--dry-run] [--workers 8]
+python scripts/bulk.py redeem [--dry-run] [--force] [--wait 120]
+
+Stop the bot first: sold positions are booked as closed and removed from scalp_positions.json.
+"""
+import os, sys, time, argparse
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import scalper as s
+
+phases = {}
+latencies = []
+results = Counter()
+
+def timed(name, fn, *args):
+    t0 = time.perf_counter()
+    try:
+        return fn(*args)
+    finally:
+        phases[name] = phases.get(name, 0) + time.perf_counter() - t0
+
+def label(p):
+    return "%s %s %s" % ((p.asset or "?").upper(), p.side or "?", (p.title or "")[:40])
+
+def report(i, n, status, msg):
+    results[status] += 1
+    print("  %-8s %-9s %s" % ("[%d/%d]" % (i, n) if i else "", status.upper(), msg), flush=True)
+
+def summary():
+    print("\nSummary: " + (", ".join("%d %s" % (n, k) for k, n in sorted(results.items())) or "nothing to do"))
+    for name, sec in phases.items():
+        print("  %-10s %8.0f ms" % (name, sec * 1000))
+    if latencies:
+        lat = sorted(latencies)
+        print("  latency    p50 %.0f ms | p90 %.0f ms | max %.0f ms (%d calls)" % (
+            lat[len(lat) // 2] * 1000, lat[int(len(lat) * 0.9)] * 1000, lat[-1] * 1000, len(lat)))
+
+# ── cancel ──
+
+def cmd_cancel(positions, args):
+    pending = [p for p in positions if p.status == "pending" and p.buy_order_id]
+    print("Open bids: %d" % len(pending))
+    if not pending:
+        return 0
+    if args.dry_run:
+        for i, p in enumerate(pending, 1):
+            report(i, len(pending), "dry-run", "cancel %s" % label(p))
+        return 0
+    ok = timed("cancel", s.cancel_orders, [p.buy_order_id for p in pending])
+    for i, p in enumerate(pending, 1):
+        report(i, len(pending), "cancelled" if ok else "failed", label(p))
+    return 0 if ok else 1
+
+# ── sell ──
+
+def _sell(p, shares, price):
+    t0 = time.perf_counter()
+    oid = s.fak_sell(p.token_id, price, shares, p.tick_size or 0.01, bool(p.neg_risk))
+    latencies.append(time.perf_counter() - t0)
+    return oid
+
+def cmd_sell(positions, args):
+    if any(p.status == "pending" for p in positions):
+        cmd_cancel(positions, args)
+    bals = timed("balances", s.token_balances_onchain, [p.token_id for p in positions])
+    if positions and not bals:
+        print("On-chain balance read failed — aborting")
+        return 1
+    held = {p.token_id: p for p in positions if bals.get(p.token_id, 0) >= 1}
+    books = timed("books", s.get_books, list(held))
+    jobs = []
+    for p in held.values():
+        best = books.get(p.token_id, {}).get("best_bid", 0)
+        if best < 0.01:
+            report(0, 0, "skipped", "no bid: %s" % label(p))
+            continue
+        jobs.append((p, bals[p.token_id], best))
+    print("Selling %d of %d positions (%d with no shares)" % (len(jobs), len(positions), len(positions) - len(held)))
+    if args.dry_run:
+        for i, (p, shares, best) in enumerate(jobs, 1):
+            report(i, len(jobs), "dry-run", "sell %d @ $%.2f  %s" % (shares, best, label(p)))
+        return 0
+    sold = []
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(_sell, p, shares, best): (p, shares, best) for p, shares, best in jobs}
+        for i, f in enumerate(as_completed(futures), 1):
+            p, shares, best = futures[f]
+            if f.result():
+                sold.append((p, shares, best))
+                report(i, len(jobs), "sold", "%d @ $%.2f P&L $%+.2f  %s" % (
+                    shares, best, (best - (p.buy_price or 0)) * shares, label(p)))
+            else:
+                report(i, len(jobs), "failed", label(p))
+    phases["post"] = time.perf_counter() - t0
+    if sold:
+        timed("book", book_sales, sold)
+    print("USDC after: $%.2f" % s.usdc_balance())
+    return 0 if results["failed"] == 0 else 1
+
+def book_sales(sold):
+    """Close sold positions through the engine's close path and drop them from the positions file."""
+    s.closed.extend(s.Position.from_dict(d) for d in s.load_json(s.CLOSED_FILE, []))
+    s.load_ledger()
+    s.start_trade_export()
+    for p, shares, price in sold:
+        s.close_position(p, "manual_sell", price, round(price * shares - (p.cost or 0), 2))
+    s.save_closed()
+    s.save_ledger(force=True)
+    gone = {p.token_id for p, _, _ in sold}
+    s.save_json(s.POSITIONS_FILE, [d for d in s.load_json(s.POSITIONS_FILE, []) if d.get("token_id") not in gone])
+
+# ── redeem ──
+
+def redemptions(positions, bals):
+    """Held raw balances grouped by condition: [(condition_id, neg_risk, amounts per outcome, positions)]."""
+    by_cid, seen = {}, set()
+    for p in positions:
+        raw = bals.get(p.token_id, 0)
+        if not p.condition_id or raw <= 0 or p.token_id in seen:
+            continue
+        if p.side not in s.OUTCOMES:
+            report(0, 0, "skipped", "unknown outcome: %s" % label(p))
+            continue
+        seen.add(p.token_id)
+        cid, neg_risk, amounts, ps = by_cid.setdefault(p.condition_id, (p.condition_id, bool(p.neg_risk), [0] * len(s.OUTCOMES), []))
+        amounts[s.OUTCOMES.index(p.side)] += raw
+        ps.append(p)
+    return list(by_cid.values())
+
+def redeem_call(cid, neg_risk, amounts):
+    """(target, contract, redeemPositions args): the NegRiskAdapter takes amounts per outcome, the CTF index sets."""
+    cid_bytes = s.w3.to_bytes(hexstr=cid)
+    if neg_risk:
+        return s.NEG_RISK_ADAPTER, s.neg_risk_adapter, [cid_bytes, list(amounts)]
+    return s.CTF_ADDRESS, s.ctf_contract, [s.USDC_ADDRESS, b"\x00" * 32, cid_bytes, [1, 2]]
+
+def item_label(item):
+    cid, neg_risk, amounts, ps = item
+    held = "+".join("%s %d" % (side, raw // 1_000_000) for side, raw in zip(s.OUTCOMES, amounts) if raw)
+    return "%s [%s%s]" % (label(ps[0]), held, ", neg-risk" if neg_risk else "")
+
+def _redeem_relayer(items):
+    from py_builder_relayer_client.models import SafeTransaction, OperationType
+    txs = []
+    for cid, neg_risk, amounts, _ in items:
+        to, contract, args = redeem_call(cid, neg_risk, amounts)
+        txs.append(SafeTransaction(to=to, operation=OperationType.Call, value="0",
+                                   data=contract.encode_abi(abi_element_identifier="redeemPositions", args=args)))
+    t0 = time.perf_counter()
+    try:
+        ok = bool(s.relay_client.execute(txs, "Bulk redeem %d conditions" % len(txs)).wait())
+    except Exception as e:
+        print("  Relayer batch failed: %s" % e)
+        ok = False
+    latencies.append(time.perf_counter() - t0)
+    for i, item in enumerate(items, 1):
+        report(i, len(items), "redeemed" if ok else "failed", item_label(item))
+
+def _redeem_direct(items, wait):
+    """Send every redemption with consecutive local nonces, then wait for all receipts at once."""
+    addr = s.w3_account.address
+    nonce = s.w3.eth.get_transaction_count(addr, "pending")
+    gas_price = s.w3.eth.gas_price
+    sent = []
+    for item in items:
+        _, contract, args = redeem_call(*item[:3])
+        tx = contract.functions.redeemPositions(*args).build_transaction({
+            "from": addr, "nonce": nonce, "gas": 400_000,
+            "maxFeePerGas": int(gas_price * 1.5),
+            "maxPriorityFeePerGas": s.w3.to_wei(30, "gwei"),
+        })
+        try:
+            sent.append((item, s.w3.eth.send_raw_transaction(s.w3_account.sign_transaction(tx).raw_transaction), time.perf_counter()))
+            nonce += 1
+        except Exception as e:
+            report(0, 0, "failed", "send: %s  %s" % (e, item_label(item)))
+            nonce = s.w3.eth.get_transaction_count(addr, "pending")
+    print("Sent %d transactions, waiting for receipts" % len(sent))
+
+    def receipt(tx_hash, t0):
+        r = s.w3.eth.wait_for_transaction_receipt(tx_hash, timeout=wait)
+        latencies.append(time.perf_counter() - t0)
+        return r
+
+    with ThreadPoolExecutor(max_workers=max(1, min(16, len(sent)))) as pool:
+        futures = {pool.submit(receipt, h, t0): (item, h) for item, h, t0 in sent}
+        for i, f in enumerate(as_completed(futures), 1):
+            item, h = futures[f]
+            try:
+                ok = f.result().status == 1
+                report(i, len(sent), "redeemed" if ok else "reverted", "%s  %s" % (h.hex()[:18], item_label(item)))
+            except Exception as e:
+                report(i, len(sent), "failed", "%s %s  %s" % (h.hex()[:18], e, item_label(item)))
+
+def cmd_redeem(positions, args):
+    bals = timed("balances", s.token_balances_onchain, [p.token_id for p in positions], True)
+    if positions and not bals:
+        print("On-chain balance read failed — aborting")
+        return 1
+    items = redemptions(positions, bals)
+    if not args.force:
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            winners = timed("resolution", lambda: list(pool.map(lambda it: s.get_market_winner(it[3][0].market_id), items)))
+        for it, w in zip(items, winners):
+            if not w:
+                report(0, 0, "skipped", "unresolved: %s" % item_label(it))
+        items = [it for it, w in zip(items, winners) if w]
+    print("Redeeming %d conditions via %s" % (len(items), "relayer batch" if s.relay_client else "direct txs"))
+    if args.dry_run or not items:
+        for i, it in enumerate(items, 1):
+            report(i, len(items), "dry-run", "redeem %s" % item_label(it))
+        return 0
+    if s.relay_client:
+        timed("redeem", _redeem_relayer, items)
+    else:
+        timed("redeem", _redeem_direct, items, args.wait)
+    print("USDC after: $%.2f" % s.usdc_balance())
+    return 0 if results["failed"] + results["reverted"] == 0 else 1
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Bulk cancel / sell / redeem of tracked positions")
+    ap.add_argument("action", choices=("cancel", "sell", "redeem"))
+    ap.add_argument("--dry-run", action="store_true", help="read balances and books, send nothing")
+    ap.add_argument("--workers", type=int, default=8, help="concurrent order posts")
+    ap.add_argument("--wait", type=int, default=120, help="receipt timeout for direct redemptions (s)")
+    ap.add_argument("--force", action="store_true", help="redeem without checking Gamma for resolution")
+    args = ap.parse_args(argv)
+    timed("init", s.init_clients, args.dry_run)  # a dry run never approves or deploys
+    positions = [s.Position.from_dict(d) for d in s.load_json(s.POSITIONS_FILE, [])]
+    print("Wallet: %s | positions: %d%s" % (s.w3_account.address, len(positions), " | DRY RUN" if args.dry_run else ""))
+    try:
+        return {"cancel": cmd_cancel, "sell": cmd_sell, "redeem": cmd_redeem}[args.action](positions, args)
+    finally:
+        summary()
+
+if __name__ == "__main__":
+    sys.exit(main())
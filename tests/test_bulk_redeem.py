@@ -0,0 +1,117 @@
+"""scripts/bulk.py redemption grouping and calls against stubbed contracts, and CLI sell booking."""
+import os, sys, json, tempfile, unittest
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp())
+import bulk
+from bulk import s
+from web3 import Web3
+
+CID = "0x" + "ab" * 32
+OTHER = "0x" + "cd" * 32
+
+def pos(token_id, side, cid=CID, neg_risk=True, **kw):
+    return s.Position(token_id=token_id, side=side, condition_id=cid, neg_risk=neg_risk, asset="btc",
+                      title="BTC Up or Down", market_id="m-" + cid[-4:], **kw)
+
+class FakeContract:
+    """Records redeemPositions calls made through encode_abi or functions.…build_transaction."""
+
+    def __init__(self, name):
+        self.name, self.calls = name, []
+        self.functions = SimpleNamespace(redeemPositions=self._fn)
+
+    def encode_abi(self, abi_element_identifier, args):
+        self.calls.append((abi_element_identifier, args))
+        return "0x"
+
+    def _fn(self, *args):
+        self.calls.append(("redeemPositions", list(args)))
+        return SimpleNamespace(build_transaction=lambda tx: dict(tx, to=self.name))
+
+class RedeemTest(unittest.TestCase):
+    def setUp(self):
+        self.orig = s.w3, s.w3_account, s.ctf_contract, s.neg_risk_adapter, s.relay_client
+        self.ctf, self.adapter = FakeContract("ctf"), FakeContract("adapter")
+        self.sent = []
+        eth = SimpleNamespace(get_transaction_count=lambda a, b: 7, gas_price=100,
+                              send_raw_transaction=lambda raw: self.sent.append(raw) or b"\x01" * 32,
+                              wait_for_transaction_receipt=lambda h, timeout: SimpleNamespace(status=1))
+        s.w3 = SimpleNamespace(eth=eth, to_bytes=Web3.to_bytes, to_wei=Web3.to_wei)
+        s.w3_account = SimpleNamespace(address="0xabc", sign_transaction=lambda tx: SimpleNamespace(raw_transaction=tx))
+        s.ctf_contract, s.neg_risk_adapter, s.relay_client = self.ctf, self.adapter, None
+        bulk.results.clear()
+
+    def tearDown(self):
+        s.w3, s.w3_account, s.ctf_contract, s.neg_risk_adapter, s.relay_client = self.orig
+
+    def amounts(self, positions, bals):
+        return {cid: (neg_risk, amounts) for cid, neg_risk, amounts, _ in bulk.redemptions(positions, bals)}
+
+    def test_groups_each_outcome_into_its_slot(self):
+        up, down = pos("1", "Up"), pos("2", "Down")
+        self.assertEqual(self.amounts([up], {"1": 5_000_000}), {CID: (True, [5_000_000, 0])})
+        self.assertEqual(self.amounts([down], {"2": 3_000_000}), {CID: (True, [0, 3_000_000])})
+        self.assertEqual(self.amounts([up, down, pos("1", "Up")], {"1": 5_000_000, "2": 3_000_000}),
+                         {CID: (True, [5_000_000, 3_000_000])})
+
+    def test_skips_empty_balances_and_unknown_sides(self):
+        got = self.amounts([pos("1", "Up"), pos("2", "Down"), pos("3", None)], {"1": 0, "2": 2, "3": 9})
+        self.assertEqual(got, {CID: (True, [0, 2])})
+        self.assertEqual(bulk.results["skipped"], 1)
+
+    def test_neg_risk_goes_to_adapter_with_amounts(self):
+        items = bulk.redemptions([pos("1", "Up"), pos("2", "Down")], {"1": 4, "2": 6})
+        bulk._redeem_direct(items, 5)
+        self.assertEqual(self.adapter.calls, [("redeemPositions", [Web3.to_bytes(hexstr=CID), [4, 6]])])
+        self.assertEqual(self.ctf.calls, [])
+        self.assertEqual([tx["to"] for tx in self.sent], ["adapter"])
+        self.assertEqual(bulk.results["redeemed"], 1)
+
+    def test_standard_market_goes_to_ctf_with_index_sets(self):
+        items = bulk.redemptions([pos("1", "Up", OTHER, neg_risk=False), pos("2", "Down", CID)], {"1": 4, "2": 6})
+        bulk._redeem_direct(items, 5)
+        self.assertEqual(self.ctf.calls, [("redeemPositions", [s.USDC_ADDRESS, b"\x00" * 32, Web3.to_bytes(hexstr=OTHER), [1, 2]])])
+        self.assertEqual(self.adapter.calls, [("redeemPositions", [Web3.to_bytes(hexstr=CID), [0, 6]])])
+        self.assertEqual([tx["nonce"] for tx in self.sent], [7, 8])
+
+    def test_relayer_batch_encodes_per_market_type(self):
+        batches = []
+        s.relay_client = SimpleNamespace(execute=lambda txs, memo: batches.append(txs) or SimpleNamespace(wait=lambda: True))
+        items = bulk.redemptions([pos("1", "Down", OTHER, neg_risk=False), pos("2", "Down")], {"1": 4, "2": 6})
+        bulk._redeem_relayer(items)
+        self.assertEqual([tx.to for tx in batches[0]], [s.CTF_ADDRESS, s.NEG_RISK_ADAPTER])
+        self.assertEqual(self.ctf.calls[0][1][3], [1, 2])
+        self.assertEqual(self.adapter.calls[0][1][1], [0, 6])
+
+class BookSalesTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        names = ("POSITIONS_FILE", "CLOSED_FILE", "CLOSED_HISTORY_FILE", "LEDGER_FILE")
+        self.orig = {n: getattr(s, n) for n in names}
+        for n in names:
+            setattr(s, n, os.path.join(self.dir, n.lower() + ".json"))
+        self.orig_export = s.trade_export
+        s.trade_export = None
+        s.closed.clear()
+
+    def tearDown(self):
+        for n, v in self.orig.items():
+            setattr(s, n, v)
+        s.trade_export = self.orig_export
+        s.closed.clear()
+
+    def test_sold_positions_are_closed_and_booked(self):
+        sold, kept = pos("1", "Up", cost=4.0, status="filled"), pos("2", "Down", status="filled")
+        s.save_json(s.POSITIONS_FILE, [sold.to_dict(), kept.to_dict()])
+        bulk.book_sales([(sold, 10, 0.55)])
+        self.assertEqual([d["token_id"] for d in s.load_json(s.POSITIONS_FILE, [])], ["2"])
+        [c] = s.load_json(s.CLOSED_FILE, [])
+        self.assertEqual((c["status"], c["exit_type"], c["exit_price"], c["pnl"]), ("done", "manual_sell", 0.55, 1.5))
+        with open(s.CLOSED_HISTORY_FILE) as f:
+            self.assertEqual(json.loads(f.readline())["token_id"], "1")
+        self.assertEqual((s.ledger["all"]["all"]["trades"], s.ledger["all"]["all"]["wins"]), (1, 1))
+
+if __name__ == "__main__":
+    unittest.main()
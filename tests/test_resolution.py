@@ -0,0 +1,161 @@
+"""Resolution watcher (poll_resolutions) against a canned JSON-RPC endpoint on 127.0.0.1."""
+import os, sys, json, tempfile, threading, unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp())
+os.environ["NO_PROXY"] = "127.0.0.1"
+import scalper as s
+
+CID = "0x" + "ab" * 32
+OTHER = "0x" + "cd" * 32
+
+def payout_data(*payouts):
+    """ABI encoding of (uint outcomeSlotCount, uint[] payoutNumerators)."""
+    words = [len(payouts), 0x40, len(payouts), *payouts]
+    return "0x" + "".join("%064x" % w for w in words)
+
+class FakeRPC:
+    """
+    Canned eth_blockNumber / eth_getLogs answers: logs are (block, condition_id, payouts).
+    A failing range is answered with `fail_status` (200 = a JSON-RPC error object).
+    """
+
+    def __init__(self, head, logs=(), fail=None, fail_status=200):
+        self.head, self.logs, self.fail, self.fail_status, self.ranges = head, list(logs), fail, fail_status, []
+
+    def answer(self, req):
+        """(HTTP status, response body) for one JSON-RPC request."""
+        if req["method"] == "eth_blockNumber":
+            return 200, {"jsonrpc": "2.0", "id": req["id"], "result": hex(self.head)}
+        assert req["method"] == "eth_getLogs"
+        f = req["params"][0]
+        lo, hi = int(f["fromBlock"], 16), int(f["toBlock"], 16)
+        self.ranges.append((lo, hi))
+        if self.fail and self.fail(lo, hi):
+            if self.fail_status != 200:
+                return self.fail_status, {"message": "upstream unavailable"}
+            return 200, {"jsonrpc": "2.0", "id": req["id"], "error": {"code": -32005, "message": "query returned more than 10000 results"}}
+        assert f["address"] == s.CTF_ADDRESS and f["topics"][0] == s.CONDITION_RESOLUTION_TOPIC
+        return 200, {"jsonrpc": "2.0", "id": req["id"], "result": [
+            {"topics": [s.CONDITION_RESOLUTION_TOPIC, cid, "0x" + "0" * 64, "0x" + "0" * 64],
+             "data": payout_data(*payouts), "blockNumber": hex(block)}
+            for block, cid, payouts in self.logs if lo <= block <= hi and cid in f["topics"][1]]}
+
+class RPCHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        status, body = self.server.rpc.answer(json.loads(self.rfile.read(int(self.headers["Content-Length"]))))
+        out = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+    def log_message(self, *args):
+        pass
+
+class PollResolutionsTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), RPCHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.orig = s.RPC_URL, s.RESOLUTION_FILE
+        s.RPC_URL = "http://127.0.0.1:%d/" % self.server.server_address[1]
+        s.RESOLUTION_FILE = os.path.join(self.dir, "scalp_resolution.json")
+        s.resolution.update(block=None, payouts={}, polled_at=0.0, checked={})
+        s.positions = [s.Position(token_id="1", condition_id=CID, side="Down", status="held", market_id="m1",
+                                  end_ts=int(s.server_now()) - 120)]
+
+    def tearDown(self):
+        s.RPC_URL, s.RESOLUTION_FILE = self.orig
+        s.positions = []
+
+    def poll(self, rpc):
+        self.server.rpc = rpc
+        s.poll_resolutions()
+
+    def test_decode_and_winner(self):
+        self.assertEqual(s.decode_payouts(payout_data(0, 1)), [0, 1])
+        self.assertEqual(s.payout_winner([1, 0]), "Up")
+        self.assertEqual(s.payout_winner([0, 1]), "Down")
+        self.assertIsNone(s.payout_winner([1, 1]))
+
+    def test_resolution_log_books_payouts_and_cursor(self):
+        rpc = FakeRPC(5000, [(4990, CID, (0, 1)), (4991, OTHER, (1, 0))])
+        s.resolution["block"] = 4900
+        self.poll(rpc)
+        head = 5000 - s.RESOLUTION_CONFIRMATIONS
+        self.assertEqual(rpc.ranges, [(4901, head)])
+        self.assertEqual(s.resolution["payouts"], {CID: [0, 1]})
+        self.assertEqual(s.resolution["block"], head)
+        self.assertEqual(s.position_winner(s.positions[0]), "Down")
+        self.assertTrue(s.resolution_due(s.positions[0]))
+        with open(s.RESOLUTION_FILE) as f:
+            self.assertEqual(json.load(f), {"block": head, "payouts": {CID: [0, 1]}})
+
+    def test_rpc_error_object_keeps_cursor(self):
+        s.resolution["block"] = 4900
+        self.poll(FakeRPC(5000, [(4990, CID, (0, 1))], fail=lambda lo, hi: True))
+        self.assertEqual(s.resolution["block"], 4900)
+        self.assertEqual(s.resolution["payouts"], {})
+        self.assertFalse(s.watcher_ok())
+        self.assertFalse(os.path.exists(s.RESOLUTION_FILE))
+
+    def test_non_200_keeps_cursor(self):
+        s.resolution["block"] = 4900
+        rpc = FakeRPC(5000, [(4990, CID, (0, 1))], fail=lambda lo, hi: True, fail_status=503)
+        self.poll(rpc)
+        self.assertEqual(rpc.ranges, [(4901, 5000 - s.RESOLUTION_CONFIRMATIONS)])
+        self.assertEqual(s.resolution["block"], 4900)
+        self.assertEqual(s.resolution["payouts"], {})
+        self.assertFalse(s.watcher_ok())
+
+    def test_catch_up_spans(self):
+        span, start = s.RESOLUTION_SPAN, 1000
+        s.resolution["block"] = start
+        head = start + span * s.RESOLUTION_MAX_SPANS + 500 + s.RESOLUTION_CONFIRMATIONS
+        hit = start + span * 2 + 7
+        s.positions.append(s.Position(token_id="2", condition_id=OTHER, side="Up", status="held", market_id="m2",
+                                      end_ts=int(s.server_now()) - 120))  # still unresolved: keeps the scan going
+        rpc = FakeRPC(head, [(hit, CID, (1, 0))])
+        self.poll(rpc)
+        expected = [(start + i * span + 1, start + (i + 1) * span) for i in range(s.RESOLUTION_MAX_SPANS)]
+        self.assertEqual(rpc.ranges, expected)
+        self.assertEqual(s.resolution["block"], start + span * s.RESOLUTION_MAX_SPANS)
+        self.assertEqual(s.resolution["payouts"], {CID: [1, 0]})
+        rpc.ranges = []
+        self.poll(rpc)  # next tick finishes the remaining partial span
+        self.assertEqual(rpc.ranges, [(start + span * s.RESOLUTION_MAX_SPANS + 1, head - s.RESOLUTION_CONFIRMATIONS)])
+        self.assertEqual(s.resolution["block"], head - s.RESOLUTION_CONFIRMATIONS)
+
+    def test_failure_mid_catch_up_rescans(self):
+        s.resolution["block"] = 1000
+        rpc = FakeRPC(1000 + 3 * s.RESOLUTION_SPAN + s.RESOLUTION_CONFIRMATIONS,
+                      fail=lambda lo, hi: lo > 1000 + s.RESOLUTION_SPAN)
+        self.poll(rpc)
+        self.assertEqual(len(rpc.ranges), 2)
+        self.assertEqual(s.resolution["block"], 1000)
+
+    def test_no_held_conditions_moves_cursor_to_head(self):
+        s.positions = []
+        rpc = FakeRPC(5000)
+        self.poll(rpc)
+        self.assertEqual(rpc.ranges, [])
+        self.assertEqual(s.resolution["block"], 5000 - s.RESOLUTION_CONFIRMATIONS)
+
+    def test_prune_drops_checked_of_closed_positions(self):
+        s.resolution["checked"].update({"1": 100.0, "gone": 100.0})
+        s.prune_winner_cache()
+        self.assertEqual(s.resolution["checked"], {"1": 100.0})
+
+if __name__ == "__main__":
+    unittest.main()